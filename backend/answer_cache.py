@@ -0,0 +1,83 @@
+# backend/answer_cache.py
+"""
+Семантический кэш ответов на поисковые запросы.
+
+Записи хранятся в Redis по ключу answer_cache:{graph_id}:{версия графа}, поэтому любая загрузка
+текста в граф (новая версия) автоматически делает старые ответы недоступными.
+Новый запрос получает сохранённый ответ, если косинусная близость его эмбеддинга
+к одному из закэшированных запросов того же графа не ниже ANSWER_CACHE_THRESHOLD.
+"""
+import os
+import json
+import base64
+
+import numpy as np
+
+from backend.vector_index import graph_version_key
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.97"))
+# Сколько последних запросов храним на одну версию графа
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+
+
+def answer_cache_key(graph_id: int, version: int) -> str:
+    return f"answer_cache:{graph_id}:{version}"
+
+
+def invalidate_graph(redis_client, graph_id: int):
+    """
+    Для удалённого графа: новая версия сбрасывает кэш ответов и векторные индексы воркеров
+    """
+    version = redis_client.incr(graph_version_key(graph_id))
+    redis_client.delete(answer_cache_key(graph_id, version - 1))
+
+
+class AnswerCache:
+    def __init__(self, get_client, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl: int = ANSWER_CACHE_TTL_SECONDS,
+                 enabled: bool = ANSWER_CACHE_ENABLED):
+        self.get_client = get_client
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+
+    def lookup(self, graph_id: int, version: int, query_vec):
+        """
+        Ответ на ближайший закэшированный запрос или None, если он дальше порога
+        """
+        if not self.enabled:
+            return None
+        entries = [json.loads(raw) for raw in self.get_client().lrange(answer_cache_key(graph_id, version), 0, -1)]
+        if not entries:
+            return None
+        matrix = np.stack([np.frombuffer(base64.b64decode(entry["embedding"]), dtype=np.float32) for entry in entries])
+        sims = matrix @ np.asarray(query_vec, dtype=np.float32)
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+        print(f"Ответ из кэша (близость {sims[best]:.4f} к запросу {entries[best]['query']!r})")
+        return entries[best]["answer"]
+
+    def store(self, graph_id: int, version: int, query: str, query_vec, answer: str):
+        if not self.enabled:
+            return
+        entry = json.dumps({
+            "query": query,
+            "embedding": base64.b64encode(np.asarray(query_vec, dtype=np.float32).tobytes()).decode(),
+            "answer": answer,
+        }, ensure_ascii=False)
+        key = answer_cache_key(graph_id, version)
+        pipe = self.get_client().pipeline(transaction=False)
+        pipe.lpush(key, entry)
+        pipe.ltrim(key, 0, self.max_entries - 1)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def drop_version(self, graph_id: int, version: int):
+        """
+        Ответы прошлой версии уже недостижимы; удаляем их сразу, не дожидаясь TTL
+        """
+        self.get_client().delete(answer_cache_key(graph_id, version))
@@ -3,10 +3,15 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from backend import models, database
+from backend.user_cache import UserCache
 from pydantic import BaseModel
 import os
+import redis
+import redis.asyncio as redis_async
 from datetime import datetime, timedelta
 
 SECRET_KEY = "secret"
@@ -17,6 +22,23 @@ REFRESH_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 дней
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+_redis_client = None
+_async_redis_client = None
+
+def get_redis_client():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(host="redis", port=6379, db=0)
+    return _redis_client
+
+def get_async_redis_client():
+    global _async_redis_client
+    if _async_redis_client is None:
+        _async_redis_client = redis_async.Redis(host="redis", port=6379, db=0)
+    return _async_redis_client
+
+user_cache = UserCache(get_redis_client, get_async_redis_client)
+
 class UserIn(BaseModel):
     username: str
     password: str
@@ -31,6 +53,12 @@ class UserOut(BaseModel):
 class PasswordChange(BaseModel):
     new_password: str
 
+# Пользователь из токена: только поля, которые нужны эндпоинтам, чтобы его можно было кэшировать
+class CurrentUser(BaseModel):
+    id: int
+    username: str
+    is_admin: bool = False
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -43,7 +71,7 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid authentication",
@@ -56,10 +84,15 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == username).first()
+    cached, version = await user_cache.get_async(username)
+    if cached is not None:
+        return CurrentUser(**cached)
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    user = result.scalars().first()
     if user is None:
         raise credentials_exception
-    return user
+    await user_cache.put_async(user, version)
+    return CurrentUser(id=user.id, username=user.username, is_admin=user.is_admin)
 
 def authenticate_user(db: Session, username: str, password: str):
     user = db.query(models.User).filter(models.User.username == username).first()
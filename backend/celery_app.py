@@ -0,0 +1,65 @@
+# backend/celery_app.py
+"""
+Лёгкий модуль с приложением Celery и именами задач.
+
+API ставит задачи в очередь по имени через celery_app.send_task и не импортирует backend.tasks,
+поэтому в процессах gunicorn не загружаются torch, модель эмбеддингов и клиенты Memgraph.
+
+Задачи разведены по очередям: поиск идёт в очередь search, загрузка документов и пересчёт
+центральности — в ingest. Каждую очередь обслуживает свой пул воркеров (см. docker-compose.yml),
+поэтому загрузка книги не занимает воркеры, которые отвечают на поиск.
+"""
+import os
+
+from celery import Celery
+from kombu import Queue
+
+celery_app = Celery(
+    'tasks',
+    broker='redis://redis:6379/0',            # очередь задач
+    backend='redis://redis:6379/1',           # <- это нужно для хранения результатов
+)
+# Результаты задач в db 1 удаляются через сутки (по умолчанию), а не копятся навсегда
+celery_app.conf.result_expires = int(os.getenv("CELERY_RESULT_EXPIRES", str(24 * 60 * 60)))
+
+PROCESS_TEXT_TASK = "backend.tasks.process_text_task"
+PROCESS_DOCUMENT_TASK = "backend.tasks.process_document_task"
+SEARCH_GRAPH_TASK = "backend.tasks.search_graph_task"
+
+INGEST_QUEUE = os.getenv("CELERY_INGEST_QUEUE", "ingest")
+SEARCH_QUEUE = os.getenv("CELERY_SEARCH_QUEUE", "search")
+
+# В транспорте Redis меньшее число — более высокий приоритет
+SEARCH_PRIORITY = 0
+INGEST_PRIORITY = 5
+# Финал распределённой загрузки обгоняет подзадачи новых документов: пользователь уже ждёт его
+FINALIZE_PRIORITY = 3
+# Пересчёт PageRank фоновый и уступает всему остальному
+CENTRALITY_PRIORITY = 9
+
+# Загрузка может идти дольше часа (видимость по умолчанию в Redis): с acks_late
+# неподтверждённую задачу иначе выдали бы второму воркеру, пока первый её ещё выполняет
+CELERY_VISIBILITY_TIMEOUT = int(os.getenv("CELERY_VISIBILITY_TIMEOUT", str(12 * 60 * 60)))
+
+celery_app.conf.update(
+    task_queues=[Queue(INGEST_QUEUE), Queue(SEARCH_QUEUE)],
+    task_default_queue=INGEST_QUEUE,
+    task_routes={
+        SEARCH_GRAPH_TASK: {"queue": SEARCH_QUEUE, "priority": SEARCH_PRIORITY},
+        PROCESS_TEXT_TASK: {"queue": INGEST_QUEUE, "priority": INGEST_PRIORITY},
+        PROCESS_DOCUMENT_TASK: {"queue": INGEST_QUEUE, "priority": INGEST_PRIORITY},
+        "backend.tasks.extract_chunks_task": {"queue": INGEST_QUEUE, "priority": INGEST_PRIORITY},
+        "backend.tasks.finalize_graph_task": {"queue": INGEST_QUEUE, "priority": FINALIZE_PRIORITY},
+        "backend.tasks.ingest_failed_task": {"queue": INGEST_QUEUE, "priority": FINALIZE_PRIORITY},
+        "backend.tasks.compute_centrality_task": {"queue": INGEST_QUEUE, "priority": CENTRALITY_PRIORITY},
+    },
+    task_default_priority=INGEST_PRIORITY,
+    broker_transport_options={
+        "priority_steps": list(range(10)),
+        "sep": ":",
+        "queue_order_strategy": "priority",
+        "visibility_timeout": CELERY_VISIBILITY_TIMEOUT,
+    },
+    # Воркер берёт одну задачу на процесс: длинная загрузка не держит за собой очередь из соседних
+    worker_prefetch_multiplier=int(os.getenv("CELERY_PREFETCH_MULTIPLIER", "1")),
+)
@@ -1,4 +1,4 @@
 # celery_worker.py
-from backend.tasks import celery
+from backend.tasks import celery_app
 
-celery.worker_main()
+celery_app.worker_main()
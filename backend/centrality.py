@@ -0,0 +1,152 @@
+# backend/centrality.py
+"""
+PageRank узлов графа, посчитанный один раз после загрузки и сохранённый в свойство e.pagerank.
+
+Граф читается из Memgraph списком рёбер, PageRank считается векторно в numpy
+(как nx.pagerank на неориентированном графе), а результат пишется пачками.
+Оценки делятся на максимальную, чтобы самый центральный узел графа имел 1.0
+и вес PageRank в ранжировании не зависел от размера графа.
+
+    python -m backend.centrality [--graph-id 42]
+"""
+import os
+import argparse
+import time
+
+import numpy as np
+import mgclient
+
+from backend.graph_writer import BulkWriter
+
+PAGERANK_DAMPING = float(os.getenv("PAGERANK_DAMPING", "0.85"))
+PAGERANK_MAX_ITER = int(os.getenv("PAGERANK_MAX_ITER", "100"))
+PAGERANK_TOL = float(os.getenv("PAGERANK_TOL", "1e-6"))
+# Пересчёт после загрузки откладывается: несколько загрузок подряд дают один пересчёт
+CENTRALITY_DEBOUNCE_SECONDS = int(os.getenv("CENTRALITY_DEBOUNCE_SECONDS", "30"))
+# Срок жизни отметки о потоковой загрузке графа, если воркер упал, не сняв её
+INGEST_ACTIVE_TTL_SECONDS = int(os.getenv("INGEST_ACTIVE_TTL_SECONDS", str(6 * 60 * 60)))
+
+NODES_QUERY = """
+MATCH (e:Entity {graph_id: $graph_id})
+RETURN id(e)
+"""
+
+EDGES_QUERY = """
+MATCH (a:Entity {graph_id: $graph_id})-[]->(b:Entity {graph_id: $graph_id})
+RETURN id(a), id(b)
+"""
+
+STORE_PAGERANK_QUERY = """
+UNWIND $rows AS row
+MATCH (e:Entity)
+WHERE id(e) = row.id
+SET e.pagerank = row.pagerank
+"""
+
+GRAPH_IDS_QUERY = """
+MATCH (e:Entity)
+RETURN DISTINCT e.graph_id
+"""
+
+
+def centrality_version_key(graph_id: int) -> str:
+    return f"centrality_version:{graph_id}"
+
+
+def centrality_pending_key(graph_id: int) -> str:
+    return f"centrality_pending:{graph_id}"
+
+
+def ingest_active_key(graph_id: int) -> str:
+    """
+    Число идущих потоковых загрузок графа: пока оно больше нуля, PageRank не пересчитывается
+    """
+    return f"ingest_active:{graph_id}"
+
+
+def pagerank(size: int, sources: np.ndarray, targets: np.ndarray, damping: float = PAGERANK_DAMPING,
+             max_iter: int = PAGERANK_MAX_ITER, tol: float = PAGERANK_TOL) -> np.ndarray:
+    """
+    Степенной метод по списку рёбер. Рёбра считаются неориентированными и без кратности,
+    а вес висячих узлов распределяется равномерно — так же, как у nx.pagerank(nx.Graph)
+    """
+    if size == 0:
+        return np.zeros(0, dtype=np.float64)
+    src = np.concatenate([sources, targets]).astype(np.int64)
+    dst = np.concatenate([targets, sources]).astype(np.int64)
+    keep = src != dst
+    pairs = np.unique(src[keep] * size + dst[keep])
+    src, dst = pairs // size, pairs % size
+
+    out_degree = np.bincount(src, minlength=size).astype(np.float64)
+    dangling = out_degree == 0
+    inv_degree = np.divide(1.0, out_degree, out=np.zeros(size), where=~dangling)
+
+    scores = np.full(size, 1.0 / size)
+    for _ in range(max_iter):
+        spread = np.bincount(dst, weights=(scores * inv_degree)[src], minlength=size)
+        updated = damping * (spread + scores[dangling].sum() / size) + (1.0 - damping) / size
+        converged = np.abs(updated - scores).sum() < size * tol
+        scores = updated
+        if converged:
+            break
+    return scores
+
+
+def compute_centrality(conn, graph_id: int) -> int:
+    """
+    Пересчитывает PageRank одного графа и записывает его в e.pagerank. Возвращает число узлов
+    """
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(NODES_QUERY, {"graph_id": graph_id})
+        node_ids = np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+        cursor.execute(EDGES_QUERY, {"graph_id": graph_id})
+        edges = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+    finally:
+        cursor.close()
+    conn.commit()
+
+    # Внутренние id Memgraph переводятся в позиции 0..n-1
+    node_ids.sort()
+    positions = np.searchsorted(node_ids, edges)
+    scores = pagerank(len(node_ids), positions[:, 0], positions[:, 1])
+    if len(scores):
+        scores /= scores.max()
+
+    writer = BulkWriter(conn, STORE_PAGERANK_QUERY, label="pagerank")
+    writer.extend({"id": int(node_id), "pagerank": float(score)} for node_id, score in zip(node_ids, scores))
+    writer.close()
+    print(
+        f"PageRank графа {graph_id}: {len(node_ids)} узлов, {len(edges)} рёбер, "
+        f"{(time.perf_counter() - started) * 1000:.1f} мс"
+    )
+    return len(node_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчёт PageRank узлов Entity")
+    parser.add_argument("--graph-id", type=int, default=None, help="пересчитать только один граф")
+    parser.add_argument("--host", default="memgraph")
+    parser.add_argument("--port", type=int, default=7687)
+    args = parser.parse_args()
+
+    conn = mgclient.connect(host=args.host, port=args.port)
+    try:
+        if args.graph_id is not None:
+            graph_ids = [args.graph_id]
+        else:
+            cursor = conn.cursor()
+            cursor.execute(GRAPH_IDS_QUERY)
+            graph_ids = [row[0] for row in cursor.fetchall() if row[0] is not None]
+            cursor.close()
+            conn.commit()
+        for graph_id in graph_ids:
+            compute_centrality(conn, graph_id)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
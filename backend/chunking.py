@@ -0,0 +1,225 @@
+# backend/chunking.py
+"""
+Разбиение документа на чанки для извлечения графа.
+
+CHUNKER выбирает способ:
+  chars  — окна по 1000 символов с перекрытием 150 символов (как раньше);
+  tokens — целые предложения упаковываются в чанк до CHUNK_TOKEN_BUDGET токенов,
+           перекрытие — CHUNK_OVERLAP_SENTENCES последних предложений предыдущего чанка.
+
+Токены считаются оценкой по длине слов (CHUNK_TOKEN_COUNTER=heuristic)
+или точно, запросом tokens_count к GigaChat (CHUNK_TOKEN_COUNTER=gigachat).
+"""
+import os
+import re
+import math
+from collections import OrderedDict
+
+CHUNKER = os.getenv("CHUNKER", "chars")
+CHUNK_SIZE_CHARS = int(os.getenv("CHUNK_SIZE_CHARS", "1000"))
+CHUNK_OVERLAP_CHARS = int(os.getenv("CHUNK_OVERLAP_CHARS", "150"))
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", "1024"))
+CHUNK_OVERLAP_SENTENCES = int(os.getenv("CHUNK_OVERLAP_SENTENCES", "1"))
+CHUNK_TOKEN_COUNTER = os.getenv("CHUNK_TOKEN_COUNTER", "heuristic")
+# Средняя длина токена GigaChat в символах для оценки (русский и татарский текст)
+CHUNK_CHARS_PER_TOKEN = float(os.getenv("CHUNK_CHARS_PER_TOKEN", "4"))
+
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def iter_text_by_overlap(text: str, chunk_size: int = CHUNK_SIZE_CHARS, overlap: int = CHUNK_OVERLAP_CHARS):
+    """
+    Символьные окна с перекрытием, без копии всего документа в списке
+    """
+    for start in range(0, len(text), chunk_size - overlap):
+        yield text[start:start + chunk_size]
+
+
+def iter_pages_by_overlap(pages, chunk_size: int = CHUNK_SIZE_CHARS, overlap: int = CHUNK_OVERLAP_CHARS):
+    """
+    Те же окна, что iter_text_by_overlap для страниц, склеенных через перевод строки,
+    но в памяти держится только ещё не разрезанный хвост
+    """
+    step = chunk_size - overlap
+    buffer, first = "", True
+    for page in pages:
+        buffer += page if first else "\n" + page
+        first = False
+        while len(buffer) >= chunk_size:
+            yield buffer[:chunk_size]
+            buffer = buffer[step:]
+    yield from iter_text_by_overlap(buffer, chunk_size, overlap)
+
+
+def split_text_by_overlap(text: str, chunk_size: int = CHUNK_SIZE_CHARS, overlap: int = CHUNK_OVERLAP_CHARS) -> list:
+    return list(iter_text_by_overlap(text, chunk_size, overlap))
+
+
+class HeuristicTokenCounter:
+    """
+    Оценка числа токенов: знак препинания — токен, слово — его длина, делённая на CHUNK_CHARS_PER_TOKEN
+    """
+
+    def __init__(self, chars_per_token: float = CHUNK_CHARS_PER_TOKEN):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text: str) -> int:
+        return sum(max(1, math.ceil(len(word) / self.chars_per_token)) for word in WORD_RE.findall(text))
+
+    def count_many(self, texts: list) -> list:
+        return [self.count(text) for text in texts]
+
+
+class GigaChatTokenCounter:
+    """
+    Точный подсчёт токенизатором GigaChat. Предложения отправляются пачками,
+    а результаты запоминаются, чтобы повторный проход по документу не ходил в API
+    """
+
+    def __init__(self, batch_size: int = 100, max_cached: int = 65536):
+        self.batch_size = batch_size
+        self.max_cached = max_cached
+        self.cache = OrderedDict()
+
+    def count_many(self, texts: list) -> list:
+        from backend import giga
+
+        missing = [text for text in dict.fromkeys(texts) if text not in self.cache]
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            for text, tokens in zip(batch, giga.count_tokens(batch)):
+                self.cache[text] = tokens
+        while len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+        return [self.cache[text] if text in self.cache else HeuristicTokenCounter().count(text) for text in texts]
+
+    def count(self, text: str) -> int:
+        return self.count_many([text])[0]
+
+
+def create_token_counter(name: str = CHUNK_TOKEN_COUNTER):
+    if name == "heuristic":
+        return HeuristicTokenCounter()
+    if name == "gigachat":
+        return GigaChatTokenCounter()
+    raise ValueError(f"неизвестный счётчик токенов: {name}")
+
+
+_token_counter = None
+
+
+def get_token_counter():
+    global _token_counter
+    if _token_counter is None:
+        _token_counter = create_token_counter()
+    return _token_counter
+
+
+def iter_paragraphs(text: str):
+    start = 0
+    for match in PARAGRAPH_RE.finditer(text):
+        yield text[start:match.start()]
+        start = match.end()
+    yield text[start:]
+
+
+def split_sentences(paragraph: str) -> list:
+    return [sentence.strip() for sentence in SENTENCE_END_RE.split(paragraph) if sentence.strip()]
+
+
+def split_long_sentence(sentence: str, budget: int, counter) -> list:
+    """
+    Предложение длиннее бюджета режется по словам
+    """
+    words = sentence.split()
+    pieces, current, current_tokens = [], [], 0
+    for word, tokens in zip(words, counter.count_many(words)):
+        if current and current_tokens + tokens > budget:
+            pieces.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(word)
+        current_tokens += tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def iter_token_chunks(text: str, budget: int = CHUNK_TOKEN_BUDGET,
+                      overlap_sentences: int = CHUNK_OVERLAP_SENTENCES, counter=None):
+    return iter_paragraph_chunks(iter_paragraphs(text), budget, overlap_sentences, counter)
+
+
+def iter_paragraph_chunks(paragraphs, budget: int = CHUNK_TOKEN_BUDGET,
+                          overlap_sentences: int = CHUNK_OVERLAP_SENTENCES, counter=None):
+    """
+    Упаковывает целые предложения в чанки до budget токенов. Абзацы внутри чанка
+    разделяются пустой строкой. Следующий чанк начинается с overlap_sentences
+    последних предложений предыдущего, если они занимают не больше половины бюджета
+    """
+    counter = counter or get_token_counter()
+    # Предложения текущего чанка: (текст, токены, начинает ли абзац)
+    current, current_tokens = [], 0
+
+    def render(sentences):
+        parts = []
+        for sentence, _, new_paragraph in sentences:
+            if parts:
+                parts.append("\n\n" if new_paragraph else " ")
+            parts.append(sentence)
+        return "".join(parts)
+
+    for paragraph in paragraphs:
+        sentences = split_sentences(paragraph)
+        if not sentences:
+            continue
+        units = []
+        for sentence, tokens in zip(sentences, counter.count_many(sentences)):
+            if tokens > budget:
+                pieces = split_long_sentence(sentence, budget, counter)
+                units.extend(zip(pieces, counter.count_many(pieces)))
+            else:
+                units.append((sentence, tokens))
+
+        for position, (sentence, tokens) in enumerate(units):
+            if current and current_tokens + tokens > budget:
+                yield render(current)
+                overlap = current[-overlap_sentences:] if overlap_sentences > 0 else []
+                overlap_tokens = sum(item[1] for item in overlap)
+                if overlap_tokens + tokens > budget or overlap_tokens > budget // 2:
+                    overlap, overlap_tokens = [], 0
+                current, current_tokens = list(overlap), overlap_tokens
+            current.append((sentence, tokens, position == 0))
+            current_tokens += tokens
+    if current:
+        yield render(current)
+
+
+def iter_chunks(text: str, chunker: str = CHUNKER):
+    if chunker == "chars":
+        return iter_text_by_overlap(text)
+    if chunker == "tokens":
+        return iter_token_chunks(text)
+    raise ValueError(f"неизвестный способ разбиения: {chunker}")
+
+
+def iter_page_chunks(pages, chunker: str = CHUNKER):
+    """
+    Чанки документа, который приходит по страницам. Граница страницы для tokens — граница абзаца
+    """
+    if chunker == "chars":
+        return iter_pages_by_overlap(pages)
+    if chunker == "tokens":
+        return iter_paragraph_chunks(paragraph for page in pages for paragraph in iter_paragraphs(page))
+    raise ValueError(f"неизвестный способ разбиения: {chunker}")
+
+
+def split_text(text: str, chunker: str = CHUNKER) -> list:
+    return list(iter_chunks(text, chunker))
+
+
+def count_chunks(text: str, chunker: str = CHUNKER) -> int:
+    if chunker == "chars":
+        return len(range(0, len(text), CHUNK_SIZE_CHARS - CHUNK_OVERLAP_CHARS))
+    return sum(1 for _ in iter_chunks(text, chunker))
@@ -1,4 +1,6 @@
 # backend/crud.py
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from backend import models, auth
 
@@ -33,19 +35,34 @@ def save_query_result(db: Session, query: str, response: str, graph_id: int, use
     db.add(record)
     db.commit()
 
-def get_user_graphs(db: Session, user_id: int):
-    return db.query(models.KnowledgeGraph).filter(models.KnowledgeGraph.owner_id == user_id).all()
+async def get_user_graphs(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.KnowledgeGraph).where(models.KnowledgeGraph.owner_id == user_id))
+    return result.scalars().all()
 
 
 # crud.py
-def get_user_history(db: Session, user_id: int):
-    return (
-        db.query(models.SearchHistory)
-        .filter(models.SearchHistory.user_id == user_id)
-        .join(models.KnowledgeGraph)
-        .order_by(models.SearchHistory.created_at.desc())
-        .all()
+async def get_user_history(db: AsyncSession, user_id: int, limit: int, before: tuple = None):
+    """
+    Страница истории от новых к старым вместе с названием графа одним запросом.
+    before — (created_at, id) последней записи предыдущей страницы
+    """
+    query = (
+        select(
+            models.SearchHistory.id,
+            models.SearchHistory.query,
+            models.SearchHistory.response,
+            models.SearchHistory.created_at,
+            models.KnowledgeGraph.title.label("graph_title"),
+        )
+        # Записи удалённых графов остаются с graph_id = NULL и показываются без названия
+        .outerjoin(models.KnowledgeGraph, models.SearchHistory.graph_id == models.KnowledgeGraph.id)
+        .where(models.SearchHistory.user_id == user_id)
     )
+    if before is not None:
+        query = query.where(tuple_(models.SearchHistory.created_at, models.SearchHistory.id) < before)
+    query = query.order_by(models.SearchHistory.created_at.desc(), models.SearchHistory.id.desc()).limit(limit)
+    result = await db.execute(query)
+    return result.all()
 
 def get_graph_by_id(db: Session, graph_id: int):
     return db.query(models.KnowledgeGraph).filter(models.KnowledgeGraph.id == graph_id).first()
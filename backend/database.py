@@ -1,14 +1,57 @@
 # backend/database.py
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# Пулы соединений заводятся в каждом процессе gunicorn и Celery, а Postgres 13 по умолчанию
+# принимает max_connections = 100 (3 из них зарезервированы для суперпользователя).
+# Предел на процесс API: DB_POOL_SIZE + DB_MAX_OVERFLOW + ASYNC_DB_POOL_SIZE + ASYNC_DB_MAX_OVERFLOW,
+# по умолчанию 5 + 10 = 15, на 4 воркера gunicorn — 60. Воркеры Celery пользуются только
+# синхронным пулом: не больше 5 на процесс, при concurrency 2 + 4 — 30. Итого 90 < 97.
+# При увеличении --workers, --concurrency или --scale уменьшайте пулы так, чтобы сумма
+# оставалась меньше max_connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "3"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "2"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# Асинхронный пул нужен только API: в нём обслуживаются горячие эндпоинты
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "5"))
+ASYNC_DB_MAX_OVERFLOW = int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "5"))
+
+POOL_OPTIONS = {
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+
+def async_database_url(url: str) -> str:
+    """
+    Тот же Postgres через драйвер asyncpg
+    """
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+engine = create_engine(DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Асинхронный движок для горячих эндпоинтов API: запрос не занимает поток из пула FastAPI
+# Соединения открываются при первом запросе, поэтому в воркерах Celery этот пул пуст
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, pool_size=ASYNC_DB_POOL_SIZE, max_overflow=ASYNC_DB_MAX_OVERFLOW, **POOL_OPTIONS
+)
+AsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -17,3 +60,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,272 @@
+# backend/documents.py
+"""
+Загрузка документов на сервер и постраничный разбор.
+
+API разбирает тело запроса по мере поступления и пишет файл блоками в UPLOAD_DIR (общий том
+API и воркеров загрузки), а в задачу передаёт только путь, а не текст. Воркер разбирает документ по страницам:
+PDF — пачками по PARSE_PAGES_PER_BATCH страниц в пуле из PARSE_WORKERS процессов,
+DOCX — группами абзацев, веб-страницу — целиком. Страницы выдаются по порядку и
+сразу уходят в разбиение на чанки, поэтому весь текст документа в памяти не собирается.
+"""
+import os
+import re
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/data/uploads")
+# Как client_max_body_size в nginx
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(300 * 1024 * 1024)))
+UPLOAD_BLOCK_BYTES = int(os.getenv("UPLOAD_BLOCK_BYTES", str(1024 * 1024)))
+# Обычные поля формы (graph_id) короткие, держим их в памяти
+UPLOAD_FIELD_MAX_BYTES = 64 * 1024
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "2"))
+PARSE_PAGES_PER_BATCH = int(os.getenv("PARSE_PAGES_PER_BATCH", "8"))
+DOCX_PARAGRAPHS_PER_PAGE = int(os.getenv("DOCX_PARAGRAPHS_PER_PAGE", "50"))
+URL_FETCH_TIMEOUT = float(os.getenv("URL_FETCH_TIMEOUT", "30"))
+
+KIND_PDF = "pdf"
+KIND_DOCX = "docx"
+KIND_URL = "url"
+
+EXTENSIONS = {".pdf": KIND_PDF, ".docx": KIND_DOCX}
+CONTENT_TYPES = {
+    "application/pdf": KIND_PDF,
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": KIND_DOCX,
+}
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class UnsupportedDocument(ValueError):
+    pass
+
+
+def document_kind(filename: str, content_type: str = None):
+    """
+    pdf, docx или None, если формат не поддерживается
+    """
+    kind = EXTENSIONS.get(os.path.splitext(filename or "")[1].lower())
+    return kind or CONTENT_TYPES.get(content_type)
+
+
+class StreamedUpload:
+    """
+    Разбирает тело multipart/form-data по мере поступления блоков из request.stream():
+    поле с файлом сразу пишется в UPLOAD_DIR, остальные (короткие) поля собираются в fields.
+    Тело целиком не держится ни в памяти, ни во временном файле. Воркер видит файл только
+    после переименования в finish(), то есть целиком записанным
+    """
+
+    def __init__(self, content_type: str, file_field: str = "file", max_bytes: int = UPLOAD_MAX_BYTES):
+        try:
+            from python_multipart.multipart import MultipartParser, parse_options_header
+        except ImportError:  # python-multipart < 0.0.13
+            from multipart.multipart import MultipartParser, parse_options_header
+
+        self._parse_options_header = parse_options_header
+        mime, options = parse_options_header(content_type or "")
+        boundary = options.get(b"boundary")
+        if mime != b"multipart/form-data" or not boundary:
+            raise ValueError("ожидается multipart/form-data")
+
+        self.file_field = file_field
+        self.max_bytes = max_bytes
+        self.fields = {}
+        self.path = None
+        self.kind = None
+        self._partial = None
+        self._out = None
+        self._written = 0
+        self._headers = {}
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._field_name = None
+        self._field_value = bytearray()
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def write(self, block: bytes):
+        self._parser.write(block)
+
+    def finish(self) -> str:
+        """
+        Путь к сохранённому файлу; без поля файла — ValueError
+        """
+        self._parser.finalize()
+        if self._out is None:
+            raise ValueError(f"в запросе нет поля {self.file_field}")
+        self._out.close()
+        os.replace(self._partial, self.path)
+        return self.path
+
+    def abort(self):
+        if self._out is not None:
+            self._out.close()
+            remove_upload(self._partial)
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._field_name = None
+        self._field_value = bytearray()
+
+    def _on_header_field(self, data, start, end):
+        self._header_field.extend(data[start:end])
+
+    def _on_header_value(self, data, start, end):
+        self._header_value.extend(data[start:end])
+
+    def _on_header_end(self):
+        self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+
+    def _on_headers_finished(self):
+        _, options = self._parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._field_name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        if self._field_name != self.file_field:
+            return
+        if self._out is not None:
+            raise ValueError(f"поле {self.file_field} передано дважды")
+        filename = options.get(b"filename", b"").decode("utf-8", errors="replace")
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1")
+        self.kind = document_kind(filename, content_type)
+        if self.kind is None:
+            raise UnsupportedDocument("Поддерживаются только PDF и DOCX")
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        self.path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}.{self.kind}")
+        self._partial = self.path + ".part"
+        self._out = open(self._partial, "wb")
+
+    def _on_part_data(self, data, start, end):
+        if self._field_name == self.file_field:
+            self._written += end - start
+            if self._written > self.max_bytes:
+                raise UploadTooLarge(f"файл больше {self.max_bytes} байт")
+            self._out.write(data[start:end])
+            return
+        self._field_value.extend(data[start:end])
+        if len(self._field_value) > UPLOAD_FIELD_MAX_BYTES:
+            raise ValueError(f"поле {self._field_name} слишком длинное")
+
+    def _on_part_end(self):
+        if self._field_name and self._field_name != self.file_field:
+            self.fields[self._field_name] = self._field_value.decode("utf-8", errors="replace")
+
+
+def remove_upload(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def pdf_page_count(path: str) -> int:
+    import fitz  # PyMuPDF
+
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def parse_pdf_pages(path: str, start: int, stop: int) -> list:
+    """
+    Текст страниц [start, stop). Выполняется в процессе пула, документ открывается заново
+    """
+    import fitz  # PyMuPDF
+
+    with fitz.open(path) as doc:
+        return [doc[number].get_text() for number in range(start, stop)]
+
+
+def pdf_page_ranges(page_count: int, batch: int = PARSE_PAGES_PER_BATCH) -> list:
+    batch = max(1, batch)
+    return [(start, min(start + batch, page_count)) for start in range(0, page_count, batch)]
+
+
+def iter_pdf_pages(path: str, page_count: int, pool=None, workers: int = PARSE_WORKERS):
+    """
+    Страницы PDF по порядку. В пуле разбирается не больше 2 * workers пачек сразу,
+    чтобы разобранный текст не копился, пока извлечение сущностей отстаёт.
+    Без пула страницы разбираются в текущем потоке
+    """
+    ranges = pdf_page_ranges(page_count)
+    if pool is None:
+        for start, stop in ranges:
+            yield from parse_pdf_pages(path, start, stop)
+        return
+
+    in_flight = deque()
+    for start, stop in ranges:
+        in_flight.append(pool.apply_async(parse_pdf_pages, (path, start, stop)))
+        if len(in_flight) >= 2 * workers:
+            yield from in_flight.popleft().get()
+    while in_flight:
+        yield from in_flight.popleft().get()
+
+
+def iter_docx_pages(path: str, paragraphs_per_page: int = DOCX_PARAGRAPHS_PER_PAGE):
+    """
+    В DOCX нет страниц до вёрстки, поэтому «страница» — группа абзацев
+    """
+    import docx
+
+    paragraphs = [paragraph.text for paragraph in docx.Document(path).paragraphs]
+    for start in range(0, len(paragraphs), paragraphs_per_page):
+        yield "\n".join(paragraphs[start:start + paragraphs_per_page])
+
+
+def fetch_url_text(url: str, max_bytes: int = UPLOAD_MAX_BYTES) -> str:
+    import requests
+    from bs4 import BeautifulSoup
+
+    with requests.get(url, timeout=URL_FETCH_TIMEOUT, stream=True) as r:
+        r.raise_for_status()
+        body = bytearray()
+        for block in r.iter_content(UPLOAD_BLOCK_BYTES):
+            body.extend(block)
+            if len(body) > max_bytes:
+                raise UploadTooLarge(f"страница больше {max_bytes} байт")
+        encoding = r.encoding or r.apparent_encoding
+    soup = BeautifulSoup(bytes(body).decode(encoding or "utf-8", errors="replace"), "html.parser")
+    # Убираем скрипты и стили
+    for s in soup(["script", "style"]):
+        s.decompose()
+    return re.sub(r"\s+", " ", soup.get_text().strip())
+
+
+@contextmanager
+def open_pages(source: str, kind: str, workers: int = PARSE_WORKERS):
+    """
+    (число страниц, итератор текста страниц) для файла в UPLOAD_DIR или ссылки.
+    Пул разбора PDF создаётся здесь, в потоке задачи, до запуска фонового потока извлечения:
+    fork из потока, пока работают torch и пул запросов к GigaChat, может унаследовать
+    захваченные ими блокировки. Пул закрывается при выходе из контекста
+    """
+    if kind == KIND_PDF:
+        page_count = pdf_page_count(source)
+        ranges = pdf_page_ranges(page_count)
+        if workers <= 1 or len(ranges) <= 1:
+            yield page_count, iter_pdf_pages(source, page_count)
+            return
+        # Пул billiard, а не multiprocessing: дочерние процессы prefork-воркера Celery помечены
+        # как демоны, и multiprocessing не разрешает им запускать свои процессы
+        from billiard import Pool
+
+        with Pool(processes=min(workers, len(ranges))) as pool:
+            yield page_count, iter_pdf_pages(source, page_count, pool, workers)
+    elif kind == KIND_DOCX:
+        pages = list(iter_docx_pages(source))
+        yield len(pages), iter(pages)
+    elif kind == KIND_URL:
+        yield 1, iter([fetch_url_text(source)])
+    else:
+        raise ValueError(f"неизвестный формат документа: {kind}")
@@ -0,0 +1,216 @@
+# backend/embeddings.py
+"""
+Бэкенды модели эмбеддингов all-MiniLM-L6-v2.
+
+EMBEDDING_BACKEND выбирает реализацию:
+  torch     — SentenceTransformer на PyTorch (как раньше);
+  onnx      — тот же граф модели в ONNX Runtime, без импорта torch в воркере;
+  onnx-int8 — ONNX с динамической int8-квантизацией весов.
+
+Все бэкенды делают mean pooling и L2-нормализацию, как SentenceTransformer,
+поэтому вектора совместимы с уже сохранёнными в Memgraph.
+
+    python -m backend.embeddings export              # выгрузить ONNX и int8-модель (нужны torch и onnx)
+    python -m backend.embeddings parity --backend onnx-int8
+
+В образе выгрузка и проверка совпадения векторов выполняются при сборке с ONNX_EXPORT=1:
+если косинус с torch ниже порога, сборка падает.
+"""
+import os
+import sys
+import inspect
+import argparse
+
+import numpy as np
+
+EMBEDDING_MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "/opt/models/all-MiniLM-L6-v2-onnx")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 — решает ONNX Runtime
+EMBEDDING_DIM = 384
+# Максимальная длина последовательности all-MiniLM-L6-v2 в SentenceTransformer
+MAX_SEQ_LENGTH = 256
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class TorchEmbeddingBackend:
+    name = "torch"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: list, batch_size: int = 64) -> np.ndarray:
+        return self.model.encode(
+            list(texts),
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+        ).astype(np.float32)
+
+
+class OnnxEmbeddingBackend:
+    name = "onnx"
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, quantized: bool = False):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        if quantized:
+            self.name = "onnx-int8"
+        model_file = ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        if not os.path.exists(os.path.join(model_dir, model_file)):
+            raise RuntimeError(f"нет {model_file} в {model_dir}: соберите образ с ONNX_EXPORT=1")
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {inp.name for inp in self.session.get_inputs()}
+
+    def _encode_batch(self, texts: list) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([enc.ids for enc in encodings], dtype=np.int64)
+        attention_mask = np.array([enc.attention_mask for enc in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([enc.type_ids for enc in encodings], dtype=np.int64)
+        token_embeddings = self.session.run(None, feeds)[0]
+
+        # Mean pooling по реальным токенам, как в SentenceTransformer
+        mask = attention_mask[:, :, None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        counts = np.maximum(mask.sum(axis=1), 1e-9)
+        return normalize(summed / counts).astype(np.float32)
+
+    def encode(self, texts: list, batch_size: int = 64) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        # Сортировка по длине уменьшает паддинг внутри батча
+        order = np.argsort([len(text) for text in texts])
+        vectors = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            batch_idx = order[start:start + batch_size]
+            vectors[batch_idx] = self._encode_batch([texts[i] for i in batch_idx])
+        return vectors
+
+
+def create_backend(name: str = EMBEDDING_BACKEND):
+    if name == "torch":
+        return TorchEmbeddingBackend()
+    if name == "onnx":
+        return OnnxEmbeddingBackend(quantized=False)
+    if name == "onnx-int8":
+        return OnnxEmbeddingBackend(quantized=True)
+    raise ValueError(f"неизвестный бэкенд эмбеддингов: {name}")
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+
+def preload_before_fork() -> bool:
+    """
+    PyTorch-модель грузится в главном процессе воркера и делится с дочерними после форка.
+    Сессии ONNX Runtime держат пулы потоков, которые не переживают fork, поэтому их создаёт каждый процесс сам
+    """
+    return EMBEDDING_BACKEND == "torch"
+
+
+def export_onnx(model_dir: str = ONNX_MODEL_DIR, model_name: str = EMBEDDING_MODEL_NAME):
+    """
+    Выгрузка трансформера в ONNX и динамическая int8-квантизация весов. Нужны torch и transformers
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(model_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    tokenizer.backend_tokenizer.save(os.path.join(model_dir, TOKENIZER_FILE))
+
+    sample = tokenizer(["пример текста для экспорта"], return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    model_path = os.path.join(model_dir, ONNX_MODEL_FILE)
+    # Экспорт через TorchScript: в новых версиях torch по умолчанию dynamo-экспортёр,
+    # которому нужен onnxscript и у которого другие правила для dynamic_axes
+    options = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            **options,
+        )
+    quantize_dynamic(model_path, os.path.join(model_dir, ONNX_INT8_MODEL_FILE), weight_type=QuantType.QInt8)
+    print(f"ONNX-модели сохранены в {model_dir}")
+
+
+PARITY_TEXTS = [
+    "Сколтех — институт науки и технологий в Москве",
+    "МФТИ сотрудничает со Сколтехом в области исследований",
+    "Казан — Татарстан Республикасының башкаласы",
+    "Knowledge graphs connect entities with typed relations",
+    "Граф знаний",
+    "Компания выпустила новую модель языкового ассистента, которая отвечает на вопросы по документам "
+    "и строит связи между упомянутыми в тексте организациями, людьми и событиями.",
+]
+
+
+def check_parity(backend_name: str, threshold: float) -> bool:
+    """
+    Сравнивает вектора бэкенда с эталонным torch: косинус каждой пары должен быть не ниже порога
+    """
+    reference = TorchEmbeddingBackend().encode(PARITY_TEXTS)
+    candidate = create_backend(backend_name).encode(PARITY_TEXTS)
+    cosines = np.sum(reference * candidate, axis=1)
+    print(f"{backend_name}: косинус с torch min={cosines.min():.5f} mean={cosines.mean():.5f}")
+    return bool(cosines.min() >= threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэкенды модели эмбеддингов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="выгрузить ONNX и int8 ONNX модели")
+    export.add_argument("--model-dir", default=ONNX_MODEL_DIR)
+    parity = commands.add_parser("parity", help="проверить совпадение векторов с torch")
+    parity.add_argument("--backend", default="onnx-int8", choices=["onnx", "onnx-int8"])
+    parity.add_argument("--threshold", type=float, default=0.98)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model_dir)
+    elif not check_parity(args.backend, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# backend/extraction_cache.py
+"""
+Кэш ответов GigaChat на извлечение графа из чанка.
+
+Ключ — sha256 от версии промпта, признака татарского языка и текста чанка, поэтому
+повторные загрузки того же документа и общие фрагменты документов не идут в LLM повторно.
+Записи живут EXTRACTION_CACHE_TTL_SECONDS, а при превышении EXTRACTION_CACHE_MAX_ENTRIES
+вытесняются самые давно использованные.
+
+    python -m backend.extraction_cache stats
+    python -m backend.extraction_cache clear
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+
+import redis
+
+from backend.giga import EXTRACTION_PROMPT_VERSION
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "1") == "1"
+EXTRACTION_CACHE_TTL_SECONDS = int(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "200000"))
+
+KEY_PREFIX = "extract:"
+# Отсортированное множество ключей по времени последнего обращения — для LRU-вытеснения
+INDEX_KEY = "extract_cache:index"
+HITS_KEY = "extract_cache:hits"
+MISSES_KEY = "extract_cache:misses"
+
+
+def cache_key(chunk: str, is_tatar: bool) -> str:
+    digest = hashlib.sha256(f"{EXTRACTION_PROMPT_VERSION}\0{int(bool(is_tatar))}\0{chunk}".encode("utf-8")).hexdigest()
+    return KEY_PREFIX + digest
+
+
+class ExtractionCache:
+    def __init__(self, get_client, ttl: int = EXTRACTION_CACHE_TTL_SECONDS,
+                 max_entries: int = EXTRACTION_CACHE_MAX_ENTRIES, enabled: bool = EXTRACTION_CACHE_ENABLED):
+        # Клиент Redis берётся через функцию, чтобы кэш не создавал соединений при импорте
+        self.get_client = get_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+
+    def get(self, chunk: str, is_tatar: bool):
+        """
+        Разобранный ответ GigaChat для чанка или None, если его нет в кэше.
+        Ошибка Redis — тоже промах: чанк просто уйдёт в GigaChat
+        """
+        if not self.enabled:
+            return None
+        key = cache_key(chunk, is_tatar)
+        try:
+            client = self.get_client()
+            value = client.get(key)
+            pipe = client.pipeline(transaction=False)
+            if value is None:
+                pipe.incr(MISSES_KEY)
+            else:
+                pipe.incr(HITS_KEY)
+                pipe.zadd(INDEX_KEY, {key: time.time()})
+                pipe.expire(key, self.ttl)
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"Ошибка кэша извлечения: {e}")
+            return None
+        return None if value is None else json.loads(value)
+
+    def put(self, chunk: str, is_tatar: bool, entities):
+        """
+        Ошибка Redis не роняет чанк: уже полученный от GigaChat ответ важнее записи в кэш
+        """
+        if not self.enabled:
+            return
+        key = cache_key(chunk, is_tatar)
+        try:
+            client = self.get_client()
+            pipe = client.pipeline(transaction=False)
+            pipe.set(key, json.dumps(entities, ensure_ascii=False), ex=self.ttl)
+            pipe.zadd(INDEX_KEY, {key: time.time()})
+            pipe.zcard(INDEX_KEY)
+            size = pipe.execute()[-1]
+            if size > self.max_entries:
+                self._evict(client, size - self.max_entries)
+        except redis.RedisError as e:
+            print(f"Ошибка кэша извлечения: {e}")
+
+    def _evict(self, client, count: int):
+        evicted = [key for key, _ in client.zpopmin(INDEX_KEY, count)]
+        if evicted:
+            client.delete(*evicted)
+
+    def stats(self) -> dict:
+        client = self.get_client()
+        # Записи, истёкшие по TTL, ещё могут числиться в индексе — чистим их при подсчёте
+        client.zremrangebyscore(INDEX_KEY, "-inf", time.time() - self.ttl)
+        hits = int(client.get(HITS_KEY) or 0)
+        misses = int(client.get(MISSES_KEY) or 0)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "entries": client.zcard(INDEX_KEY),
+        }
+
+    def clear(self):
+        client = self.get_client()
+        keys = [key for key, _ in client.zscan_iter(INDEX_KEY)]
+        for start in range(0, len(keys), 1000):
+            client.delete(*keys[start:start + 1000])
+        client.delete(INDEX_KEY, HITS_KEY, MISSES_KEY)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    cache = ExtractionCache(lambda: redis.Redis(host='redis', port=6379, db=0))
+    if command == "stats":
+        print(cache.stats())
+    elif command == "clear":
+        cache.clear()
+        print("Кэш извлечения очищен")
+    else:
+        sys.exit(f"неизвестная команда: {command}")
+
+
+if __name__ == "__main__":
+    main()
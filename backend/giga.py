@@ -1,14 +1,26 @@
 # backend/giga.py
 import os
+import time
+import random
 import requests
 import uuid
+import httpx
 from gigachat import GigaChat
+from gigachat.exceptions import ResponseError
 
 GIGACHAT_API_URL = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
 GIGACHAT_TOKEN = os.getenv("GIGACHAT_TOKEN")
 AUTHORIZATION_KEY = os.getenv("GIGACHAT_TOKEN")  # твой Authorization Key, а не токен
 TOKEN_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
 
+# Повторы запроса при 429 (лимит скоупа GIGACHAT_API_PERS), 5xx и сетевых ошибках:
+# пауза GIGACHAT_RETRY_BASE_SECONDS * 2^попытка со случайной добавкой
+GIGACHAT_RETRIES = int(os.getenv("GIGACHAT_RETRIES", "4"))
+GIGACHAT_RETRY_BASE_SECONDS = float(os.getenv("GIGACHAT_RETRY_BASE_SECONDS", "2"))
+
+# Версия промпта извлечения графа: входит в ключ кэша извлечения, менять при любой правке промпта
+EXTRACTION_PROMPT_VERSION = "1"
+
 giga = GigaChat(
    credentials=os.getenv("GIGACHAT_TOKEN"),
    verify_ssl_certs=False,
@@ -38,6 +50,26 @@ def get_access_token():
     response.raise_for_status()
     return response.json()["access_token"]
 
+def is_transient_error(exc: Exception) -> bool:
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, ResponseError):
+        # ResponseError(url, status_code, content, headers)
+        status = exc.args[1] if len(exc.args) > 1 else None
+        return status == 429 or (isinstance(status, int) and status >= 500)
+    return False
+
+def chat_with_retries(prompt: str, retries: int = GIGACHAT_RETRIES):
+    for attempt in range(retries + 1):
+        try:
+            return giga.chat(prompt)
+        except Exception as e:
+            if attempt == retries or not is_transient_error(e):
+                raise
+            delay = GIGACHAT_RETRY_BASE_SECONDS * 2 ** attempt
+            print(f"GigaChat: {e}, повтор через {delay:.0f} с")
+            time.sleep(delay + random.uniform(0, GIGACHAT_RETRY_BASE_SECONDS))
+
 def extract_knowledge_graph(text: str, is_tatar: bool = False) -> str:
     """
     Запрос к GigaChat API: извлечение сущностей и связей в виде графа
@@ -50,11 +82,17 @@ def extract_knowledge_graph(text: str, is_tatar: bool = False) -> str:
     Пример: [ {\"name\": \"Сколтех\", \"desc\": \"Институт...\",\"type\": \"Организация\", \"relations\": [{\"type\": \"СОТРУДНИЧАЕТ\", \"target\": \"МФТИ\"}] } ] 
     и ничего больше!\n""" + f"""{text}"""
 
-    response = giga.chat(prompt)
+    response = chat_with_retries(prompt)
     print("gigachat response", response)
     print("gigachat response type", type(response))
     return response.choices[0].message.content
 
+def count_tokens(texts: list) -> list:
+    """
+    Число токенов GigaChat для каждого текста
+    """
+    return [item.tokens for item in giga.tokens_count(texts)]
+
 def answer_semantic_query(query: str, graph_data: str, is_tatar: bool = False) -> str:
     """
     Получить логически связанный ответ на основе текста и графа знаний
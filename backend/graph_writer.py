@@ -0,0 +1,227 @@
+# backend/graph_writer.py
+import os
+import time
+import random
+
+# Сколько строк уходит в Memgraph одним запросом UNWIND
+MEMGRAPH_BATCH_SIZE = int(os.getenv("MEMGRAPH_BATCH_SIZE", "500"))
+# Сколько строк фиксируется одной транзакцией (не меньше размера пачки). По умолчанию — одна пачка:
+# Memgraph сразу обрывает пишущую транзакцию, столкнувшуюся с другой, и чем дольше открыта
+# транзакция, тем чаще она конфликтует с параллельной загрузкой того же графа
+MEMGRAPH_TX_SIZE = int(os.getenv("MEMGRAPH_TX_SIZE", str(MEMGRAPH_BATCH_SIZE)))
+# Повторы транзакции после конфликта с паузой MEMGRAPH_CONFLICT_BACKOFF_SECONDS * 2^попытка
+MEMGRAPH_CONFLICT_RETRIES = int(os.getenv("MEMGRAPH_CONFLICT_RETRIES", "5"))
+MEMGRAPH_CONFLICT_BACKOFF_SECONDS = float(os.getenv("MEMGRAPH_CONFLICT_BACKOFF_SECONDS", "0.05"))
+
+UPSERT_ENTITIES_QUERY = """
+UNWIND $rows AS row
+MERGE (e:Entity {name: row.name, graph_id: $graph_id})
+SET e.description = row.desc,
+e.embedding = row.embedding,
+e.embedding_dtype = row.embedding_dtype,
+e.embedding_scale = row.embedding_scale,
+e.type = row.type
+"""
+
+# Недостающие концы связей создаются пустыми узлами без эмбеддинга:
+# GigaChat часто упоминает сущности, которые не описывает отдельно
+RELATIONS_QUERY_TEMPLATE = """
+UNWIND $rows AS row
+MERGE (a:Entity {{name: row.source, graph_id: $graph_id}})
+ON CREATE SET a.description = ''
+MERGE (b:Entity {{name: row.target, graph_id: $graph_id}})
+ON CREATE SET b.description = ''
+MERGE (a)-[r:`{rel_type}` {{graph_id: $graph_id}}]->(b)
+"""
+
+
+def is_conflict_error(exc: Exception) -> bool:
+    """
+    Memgraph: "Cannot resolve conflicting transactions. You can retry this transaction..."
+    """
+    return "conflicting transactions" in str(exc).lower()
+
+
+def sanitize_rel_type(raw_type) -> str:
+    """
+    Тип связи подставляется в текст запроса, поэтому убираем из него обратные кавычки
+    """
+    rel_type = str(raw_type).replace("`", "").strip()
+    if not rel_type:
+        raise ValueError(f"пустой тип связи: {raw_type!r}")
+    return rel_type
+
+
+def relations_query(rel_type: str) -> str:
+    return RELATIONS_QUERY_TEMPLATE.format(rel_type=sanitize_rel_type(rel_type))
+
+
+def write_relations(conn, graph_id: int, relations_by_type: dict,
+                    batch_size: int = MEMGRAPH_BATCH_SIZE, tx_size: int = MEMGRAPH_TX_SIZE) -> dict:
+    """
+    Пишет связи, сгруппированные по типу: один запрос UNWIND на тип и пачку
+    """
+    totals = {"rows": 0, "failed_rows": 0, "batches": 0}
+    for rel_type, rows in relations_by_type.items():
+        writer = BulkWriter(conn, relations_query(rel_type), {"graph_id": graph_id},
+                            batch_size=batch_size, tx_size=tx_size, label=f"связи {rel_type}")
+        writer.extend(rows)
+        stats = writer.close()
+        for key in totals:
+            totals[key] += stats[key]
+    return totals
+
+
+class BulkWriter:
+    """
+    Пакетная запись строк в Memgraph одним запросом UNWIND на пачку.
+
+    Пачки копятся в открытой транзакции, пока в ней не наберётся tx_size строк или не будет вызван flush.
+    Если транзакция оборвана конфликтом с другой, она повторяется целиком с нарастающей паузой.
+    Если пачка падает по другой причине, транзакция откатывается, уже успешные пачки повторяются,
+    а упавшая пишется построчно — одна плохая строка не теряет всю пачку.
+    """
+
+    def __init__(self, conn, query: str, params: dict = None,
+                 batch_size: int = MEMGRAPH_BATCH_SIZE, tx_size: int = MEMGRAPH_TX_SIZE,
+                 label: str = "строки"):
+        self.conn = conn
+        self.query = query
+        self.params = params or {}
+        self.batch_size = max(1, batch_size)
+        self.tx_size = max(self.batch_size, tx_size)
+        self.label = label
+        self.buffer = []
+        # Пачки открытой транзакции, ещё не зафиксированные
+        self.pending = []
+        self.pending_rows = 0
+        self.stats = {"batches": 0, "rows": 0, "failed_rows": 0, "fallback_batches": 0, "batch_ms": []}
+        self.conn.autocommit = False
+
+    def add(self, row: dict):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size:
+            self._write_batch(self.buffer)
+            self.buffer = []
+
+    def extend(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        """
+        Дописывает остаток буфера и фиксирует транзакцию: перед долгой работой между пачками
+        транзакцию не стоит держать открытой
+        """
+        if self.buffer:
+            self._write_batch(self.buffer)
+            self.buffer = []
+        self._commit()
+
+    def close(self) -> dict:
+        """
+        Дописывает остаток буфера, фиксирует транзакцию и возвращает статистику
+        """
+        self.flush()
+        latencies = self.stats["batch_ms"]
+        if latencies:
+            print(
+                f"Memgraph ({self.label}): {self.stats['rows']} строк, {self.stats['batches']} пачек, "
+                f"средняя пачка {sum(latencies) / len(latencies):.1f} мс, "
+                f"построчно {self.stats['fallback_batches']} пачек, ошибок {self.stats['failed_rows']}"
+            )
+        return self.stats
+
+    def _execute(self, rows: list):
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(self.query, {**self.params, "rows": rows})
+        finally:
+            cursor.close()
+
+    def _rollback(self):
+        try:
+            self.conn.rollback()
+        except Exception as e:
+            print(f"Ошибка отката транзакции ({self.label}): {e}")
+
+    def _run_with_retry(self, batches: list):
+        """
+        Выполняет пачки одной транзакцией и фиксирует её, повторяя после конфликтов.
+        Возвращает None при успехе или последнюю ошибку (транзакция уже откачена)
+        """
+        for attempt in range(MEMGRAPH_CONFLICT_RETRIES + 1):
+            try:
+                for rows in batches:
+                    self._execute(rows)
+                self.conn.commit()
+                return None
+            except Exception as e:
+                self._rollback()
+                if attempt == MEMGRAPH_CONFLICT_RETRIES or not is_conflict_error(e):
+                    return e
+                time.sleep(MEMGRAPH_CONFLICT_BACKOFF_SECONDS * 2 ** attempt * (1 + random.random()))
+
+    def _write_batch(self, rows: list):
+        started = time.perf_counter()
+        try:
+            self._execute(rows)
+        except Exception as e:
+            self._rollback()
+            self._recover(self._take_pending(), rows, e)
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats["batches"] += 1
+        self.stats["batch_ms"].append(elapsed_ms)
+        print(f"Memgraph ({self.label}): пачка {len(rows)} строк за {elapsed_ms:.1f} мс")
+        self.pending.append(rows)
+        self.pending_rows += len(rows)
+        if self.pending_rows >= self.tx_size:
+            self._commit()
+
+    def _take_pending(self) -> list:
+        pending = self.pending
+        self.pending = []
+        self.pending_rows = 0
+        return pending
+
+    def _commit(self):
+        if not self.pending:
+            return
+        try:
+            self.conn.commit()
+        except Exception as e:
+            self._rollback()
+            self._recover(self._take_pending(), None, e)
+            return
+        self.stats["rows"] += self.pending_rows
+        self._take_pending()
+
+    def _recover(self, pending: list, failed_rows, error: Exception):
+        """
+        Транзакция откачена: повторяет её пачки, а при неустранимой ошибке пишет построчно
+        """
+        batches = pending + ([failed_rows] if failed_rows else [])
+        if is_conflict_error(error) and self._run_with_retry(batches) is None:
+            self.stats["rows"] += sum(len(rows) for rows in batches)
+            return
+        print(f"Ошибка транзакции ({self.label}): {error}. Пишем пачки по отдельности")
+        # Откат отменил и успешные пачки открытой транзакции — повторяем их
+        for rows in pending:
+            if self._run_with_retry([rows]) is None:
+                self.stats["rows"] += len(rows)
+            else:
+                self._write_rows_individually(rows)
+        if failed_rows:
+            self._write_rows_individually(failed_rows)
+
+    def _write_rows_individually(self, rows: list):
+        self.stats["fallback_batches"] += 1
+        for row in rows:
+            error = self._run_with_retry([[row]])
+            if error is None:
+                self.stats["rows"] += 1
+            else:
+                self.stats["failed_rows"] += 1
+                shown = {k: v for k, v in row.items() if k != "embedding"}
+                print(f"Ошибка при записи ({self.label}) {shown}: {error}")
@@ -4,19 +4,30 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import status
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from backend import models, database, crud
-from backend.auth import get_current_user, UserIn, UserOut, authenticate_user, create_access_token, create_refresh_token, is_admin_user, get_password_hash, PasswordChange
+from backend.auth import get_current_user, UserIn, UserOut, authenticate_user, create_access_token, create_refresh_token, is_admin_user, get_password_hash, PasswordChange, user_cache
 from pydantic import BaseModel
-from backend.tasks import process_text_task, search_graph_task
+from backend.celery_app import celery_app, PROCESS_TEXT_TASK, PROCESS_DOCUMENT_TASK, SEARCH_GRAPH_TASK
+from backend.answer_cache import invalidate_graph
+from backend.schema import ensure_indexes_safely
+from backend.pubsub import RESYNC, PubSubDispatcher
+from backend.progress import decode_event, progress_stream_key, stream_id
 from backend.crud import create_graph, get_user_graphs, get_user_history
+from backend.memgraph_pool import memgraph_pool
+from backend.documents import KIND_URL, UPLOAD_MAX_BYTES, StreamedUpload, UploadTooLarge, remove_upload
 from typing import List
 from celery.result import AsyncResult
 from fastapi import APIRouter, HTTPException
-from backend.tasks import celery_app
 from models import User
 import redis.asyncio as redis
-from fastapi import WebSocket, WebSocketDisconnect, Body
+from redis import Redis
+from fastapi import WebSocket, WebSocketDisconnect, Body, Query, Request
+from fastapi.concurrency import run_in_threadpool
 import json
+import base64
+import asyncio
+from datetime import datetime
 from typing import Optional
 from jose import JWTError, jwt
 
@@ -34,9 +45,101 @@ app.add_middleware(
 
 # Инициализация базы данных
 models.Base.metadata.create_all(bind=database.engine)
+# Индексы существующих таблиц строит python -m backend.migrations при развёртывании
+
+# Индексы Memgraph по graph_id и имени узла
+@app.on_event("startup")
+def ensure_memgraph_indexes():
+    ensure_indexes_safely()
 
 # Подключение к Redis (для WebSocket-уведомлений)
 redis_client = redis.Redis(host="redis", port=6379, db=0)
+# Синхронный клиент для обычных (def) эндпоинтов
+redis_sync_client = Redis(host="redis", port=6379, db=0)
+
+# Один слушатель pub/sub на процесс для всех WebSocket-клиентов
+dispatcher = PubSubDispatcher(redis_client)
+FINAL_STATUSES = ("SUCCESS", "FAILURE")
+
+@app.on_event("startup")
+async def start_pubsub_dispatcher():
+    dispatcher.start()
+    await dispatcher.wait_ready()
+
+@app.on_event("shutdown")
+async def stop_pubsub_dispatcher():
+    await dispatcher.stop()
+
+async def replay_events(channel: str, last_id: Optional[str] = None) -> list:
+    """
+    События канала из журнала Redis Streams после last_id, а без него — только последнее
+    """
+    key = progress_stream_key(channel)
+    if last_id is None:
+        entries = await redis_client.xrevrange(key, count=1)
+    else:
+        entries = await redis_client.xrange(key, min=f"({last_id}")
+    if entries:
+        return [decode_event(entry_id, fields) for entry_id, fields in entries]
+    # Снимок задачи, запущенной до перехода на журнал
+    legacy = await redis_client.get(channel) if last_id is None else None
+    return [json.loads(legacy)] if legacy else []
+
+async def relay_channel(websocket: WebSocket, channel: str, last_id: Optional[str] = None):
+    """
+    Отправляет клиенту события канала после last_id (или последнее событие) и новые сообщения
+    до SUCCESS/FAILURE или отключения клиента. После переподключения подписки пропущенное
+    дочитывается из журнала начиная с последнего отправленного event_id
+    """
+    last_id = last_id or None
+    try:
+        seen = stream_id(last_id) if last_id else (0, 0)
+    except ValueError:
+        last_id, seen = None, (0, 0)
+
+    async def send(data: dict) -> bool:
+        """
+        Отправляет событие, если оно новее уже отправленных; True — задача завершилась
+        """
+        nonlocal seen, last_id
+        # Событие уже отправлено из журнала
+        if "event_id" in data:
+            event = stream_id(data["event_id"])
+            if event <= seen:
+                return False
+            seen, last_id = event, data["event_id"]
+        await websocket.send_json(data)
+        return data.get("status") in FINAL_STATUSES
+
+    async with dispatcher.subscribe(channel) as queue:
+        try:
+            for data in await replay_events(channel, last_id):
+                if await send(data):
+                    return
+
+            # Клиент ничего не присылает, поэтому receive завершится только при отключении
+            disconnect = asyncio.ensure_future(websocket.receive())
+            try:
+                while True:
+                    message = asyncio.ensure_future(queue.get())
+                    done, _ = await asyncio.wait({message, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                    if disconnect in done:
+                        message.cancel()
+                        if disconnect.result().get("type") == "websocket.disconnect":
+                            return
+                        disconnect = asyncio.ensure_future(websocket.receive())
+                        continue
+                    if message.result() is RESYNC:
+                        events = await replay_events(channel, last_id or "0-0")
+                    else:
+                        events = [json.loads(message.result())]
+                    for data in events:
+                        if await send(data):
+                            return
+            finally:
+                disconnect.cancel()
+        except WebSocketDisconnect:
+            print("WebSocket отключен")
 
 # Модель графа для параметров
 class GraphCreate(BaseModel):
@@ -56,6 +159,10 @@ class TextInput(BaseModel):
     text: str
     graph_id: int
 
+class UrlInput(BaseModel):
+    url: str
+    graph_id: int
+
 # Модель запроса для параметров
 class SearchInput(BaseModel):
     query: str
@@ -68,8 +175,8 @@ def create_knowledge_graph(graph: GraphCreate, current_user=Depends(get_current_
 
 # Получение списка графов пользователя
 @app.get("/graphs/", response_model=List[GraphOut])
-def list_knowledge_graphs(current_user=Depends(get_current_user), db: Session = Depends(database.get_db)):
-    return get_user_graphs(db, current_user.id)
+async def list_knowledge_graphs(current_user=Depends(get_current_user), db: AsyncSession = Depends(database.get_async_db)):
+    return await get_user_graphs(db, current_user.id)
 
 # Регистрация пользователя
 @app.post("/register", response_model=UserOut)
@@ -112,36 +219,61 @@ POST запрос на загрузку текста в граф знаний
 """
 @app.post("/process_text/")
 def process_text(input: TextInput, current_user=Depends(get_current_user)):
-    task = process_text_task.delay(input.text, input.graph_id, current_user.id)
+    task = celery_app.send_task(PROCESS_TEXT_TASK, args=[input.text, input.graph_id, current_user.id])
+    return {"task_id": task.id}
+
+"""
+POST запрос на загрузку PDF или DOCX файла в граф знаний (multipart: graph_id и file)
+Тело разбирается по мере поступления, и файл сразу пишется на общий с воркерами том,
+слишком большой запрос обрывается на UPLOAD_MAX_BYTES. Текст извлекает Celery задача
+Возвращает task_id, статус приходит в тот же WebSocket, что и для текста
+"""
+@app.post("/process_document/")
+async def process_document(request: Request, current_user=Depends(get_current_user)):
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"файл больше {UPLOAD_MAX_BYTES} байт")
+    try:
+        upload = StreamedUpload(request.headers.get("content-type"))
+        try:
+            async for block in request.stream():
+                await run_in_threadpool(upload.write, block)
+            path = await run_in_threadpool(upload.finish)
+        except BaseException:
+            upload.abort()
+            raise
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        graph_id = int(upload.fields.get("graph_id", ""))
+    except ValueError:
+        remove_upload(path)
+        raise HTTPException(status_code=400, detail="graph_id должен быть числом")
+    try:
+        task = celery_app.send_task(PROCESS_DOCUMENT_TASK, args=[path, upload.kind, graph_id, current_user.id])
+    except Exception:
+        remove_upload(path)
+        raise
+    return {"task_id": task.id}
+
+"""
+POST запрос на загрузку веб-страницы в граф знаний
+Страницу скачивает и разбирает Celery задача
+"""
+@app.post("/process_url/")
+def process_url(input: UrlInput, current_user=Depends(get_current_user)):
+    if not input.url.startswith(("http://", "https://")):
+        raise HTTPException(status_code=400, detail="Ссылка должна начинаться с http:// или https://")
+    task = celery_app.send_task(PROCESS_DOCUMENT_TASK, args=[input.url, KIND_URL, input.graph_id, current_user.id])
     return {"task_id": task.id}
 
 # WebSocket для получения статуса загрузки текста в граф знаний
 @app.websocket("/ws/graph/{task_id}")
-async def websocket_endpoint(websocket: WebSocket, task_id: str):
+async def websocket_endpoint(websocket: WebSocket, task_id: str, last_id: Optional[str] = None):
     await websocket.accept()
-
-    existing_status = await redis_client.get(f"graph_built:{task_id}")
-    if existing_status:
-        await websocket.send_json(json.loads(existing_status))
-        return
-
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe(f"graph_built:{task_id}")
-
-    try:
-        async for message in pubsub.listen():
-            if message['type'] == 'message':
-                data = json.loads(message['data'])
-                await websocket.send_json(data)
-                if data.get("status") in ("SUCCESS", "FAILURE"):
-                    break
-    except WebSocketDisconnect:
-        await pubsub.unsubscribe(f"graph_built:{task_id}")
-        await pubsub.close()
-
-    finally:
-        await pubsub.unsubscribe(f"graph_built:{task_id}")
-        await pubsub.close()
+    await relay_channel(websocket, f"graph_built:{task_id}", last_id)
 
 """
 POST запрос на поиск по графу знаний
@@ -150,48 +282,81 @@ POST запрос на поиск по графу знаний
 """
 @app.post("/search/")
 def search_graph(input: SearchInput, current_user=Depends(get_current_user)):
-    task = search_graph_task.delay(input.query, input.graph_id, current_user.id)
+    task = celery_app.send_task(SEARCH_GRAPH_TASK, args=[input.query, input.graph_id, current_user.id])
     return {"task_id": task.id}
 
 # WebSocket для получения ответа на запрос поиска
 @app.websocket("/ws/answer/{task_id}")
-async def websocket_endpoint(websocket: WebSocket, task_id: str):
+async def websocket_endpoint(websocket: WebSocket, task_id: str, last_id: Optional[str] = None):
     await websocket.accept()
+    await relay_channel(websocket, f"answer:{task_id}", last_id)
 
-    existing_status = await redis_client.get(f"answer:{task_id}")
-    if existing_status:
-        await websocket.send_json(json.loads(existing_status))
-        return
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
 
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe(f"answer:{task_id}")
+def encode_history_cursor(created_at: datetime, item_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), item_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
 
+def decode_history_cursor(cursor: str) -> tuple:
     try:
-        async for message in pubsub.listen():
-            if message["type"] == "message":
-                data = json.loads(message["data"])
-                await websocket.send_json(data)
-                if data["status"] in {"SUCCESS", "FAILURE"}:
-                    break
-    except WebSocketDisconnect:
-        print("WebSocket отключен")
-    finally:
-        await pubsub.unsubscribe(f"answer:{task_id}")
-        await pubsub.close()
-
-# Получение истории запросов пользователя
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Получение истории запросов пользователя: страница от новых к старым и курсор следующей страницы
 @app.get("/history/")
-def get_history(current_user=Depends(get_current_user), db: Session = Depends(database.get_db)):
-    history = get_user_history(db, current_user.id)
-    return [
-        {
-            "query": item.query,
-            "response": item.response,
-            "created_at": item.created_at.isoformat(),
-            "graph_title": item.graph.title if item.graph else "Без названия"
-        }
-        for item in history
-    ]
+async def get_history(
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(database.get_async_db),
+):
+    before = decode_history_cursor(cursor) if cursor else None
+    # Лишняя запись показывает, есть ли следующая страница
+    rows = await get_user_history(db, current_user.id, limit + 1, before)
+    page = rows[:limit]
+    next_cursor = encode_history_cursor(page[-1].created_at, page[-1].id) if len(rows) > limit else None
+    return {
+        "items": [
+            {
+                "query": item.query,
+                "response": item.response,
+                "created_at": item.created_at.isoformat(),
+                "graph_title": item.graph_title or "Без названия"
+            }
+            for item in page
+        ],
+        "next_cursor": next_cursor
+    }
+
+# Узлы и связи графа для отрисовки во фронтенде
+@app.get("/graphs/{graph_id}/data")
+def get_graph_data(graph_id: int, db: Session = Depends(database.get_db), current_user=Depends(get_current_user)):
+    graph = crud.get_graph_by_id(db, graph_id)
+    if not graph or graph.owner_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Graph not found or not owned by user")
+    with memgraph_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            MATCH (a:Entity {graph_id: $graph_id})-[r]->(b:Entity {graph_id: $graph_id})
+            RETURN a.name, type(r), b.name
+            """,
+            {"graph_id": graph_id}
+        )
+        edges = cursor.fetchall()
+        cursor.execute(
+            """
+            MATCH (n:Entity {graph_id: $graph_id})
+            RETURN n.name, n.type
+            """,
+            {"graph_id": graph_id}
+        )
+        nodes = cursor.fetchall()
+        cursor.close()
+    return {"edges": [list(edge) for edge in edges], "nodes": [list(node) for node in nodes]}
 
 # Удаление графа по id
 @app.delete("/graphs/{graph_id}", status_code=204)
@@ -200,6 +365,7 @@ def delete_graph(graph_id: int, db: Session = Depends(database.get_db), current_
     if not graph or graph.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="Graph not found or not owned by user")
     crud.delete_graph(db, graph)
+    invalidate_graph(redis_sync_client, graph_id)
     return
 
 # Получение списка всех пользователей
@@ -209,6 +375,13 @@ def list_users(db: Session = Depends(database.get_db), current_user=Depends(get_
         raise HTTPException(status_code=403, detail="Недостаточно прав")
     return db.query(User).all()
 
+# Статистика кэша пользователей (попадания и промахи get_current_user)
+@app.get("/users/cache/stats")
+def user_cache_stats(current_user=Depends(get_current_user)):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    return user_cache.stats()
+
 # Удаление пользователя
 @app.delete("/users/{user_id}", status_code=204)
 def delete_user(user_id: int, db: Session = Depends(database.get_db), current_user=Depends(get_current_user)):
@@ -219,6 +392,7 @@ def delete_user(user_id: int, db: Session = Depends(database.get_db), current_us
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     db.delete(user)
     db.commit()
+    user_cache.invalidate(user.username)
     return
 
 # Смена пароля пользователя
@@ -232,4 +406,5 @@ def change_user_password(user_id: int, payload: PasswordChange, db: Session = De
     # Здесь должен быть код для хэширования нового пароля, например:
     user.hashed_password = get_password_hash(payload.new_password)
     db.commit()
+    user_cache.invalidate(user.username)
     return {"detail": "Пароль успешно изменен"}
\ No newline at end of file
@@ -0,0 +1,156 @@
+# backend/memgraph_pool.py
+"""
+Пул соединений с Memgraph на процесс.
+
+Соединение берётся через `with memgraph_pool.connection() as conn:` и возвращается в пул
+после блока. Простаивавшее дольше MEMGRAPH_HEALTH_CHECK_SECONDS соединение перед выдачей
+проверяется запросом RETURN 1, сломанное закрывается и заменяется новым.
+Пул помнит pid процесса: после fork (prefork-воркеры Celery, воркеры gunicorn)
+унаследованные соединения не используются, дочерний процесс открывает свои.
+"""
+import os
+import time
+import queue
+import threading
+from contextlib import contextmanager
+
+import mgclient
+
+MEMGRAPH_HOST = os.getenv("MEMGRAPH_HOST", "memgraph")
+MEMGRAPH_PORT = int(os.getenv("MEMGRAPH_PORT", "7687"))
+MEMGRAPH_POOL_SIZE = int(os.getenv("MEMGRAPH_POOL_SIZE", "4"))
+# Сколько ждать свободного соединения, когда заняты все MEMGRAPH_POOL_SIZE
+MEMGRAPH_POOL_TIMEOUT = float(os.getenv("MEMGRAPH_POOL_TIMEOUT", "30"))
+MEMGRAPH_HEALTH_CHECK_SECONDS = float(os.getenv("MEMGRAPH_HEALTH_CHECK_SECONDS", "30"))
+MEMGRAPH_CONNECT_RETRIES = int(os.getenv("MEMGRAPH_CONNECT_RETRIES", "3"))
+
+
+class MemgraphPool:
+    def __init__(self, host: str = MEMGRAPH_HOST, port: int = MEMGRAPH_PORT, size: int = MEMGRAPH_POOL_SIZE,
+                 timeout: float = MEMGRAPH_POOL_TIMEOUT, health_check_seconds: float = MEMGRAPH_HEALTH_CHECK_SECONDS):
+        self.host = host
+        self.port = port
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.health_check_seconds = health_check_seconds
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Забывает соединения без закрытия: после fork сокеты общие с родителем,
+        и закрытие из дочернего процесса оборвало бы их у родителя
+        """
+        with self.lock:
+            self.pid = os.getpid()
+            # Последним вернули — первым выдадим: реже простаивающие соединения меньше нуждаются в проверке
+            self.idle = queue.LifoQueue()
+            self.created = 0
+
+    def _connect(self):
+        for attempt in range(MEMGRAPH_CONNECT_RETRIES):
+            try:
+                return mgclient.connect(host=self.host, port=self.port)
+            except mgclient.OperationalError as e:
+                if attempt == MEMGRAPH_CONNECT_RETRIES - 1:
+                    raise
+                print(f"Не удалось подключиться к Memgraph ({e}), повтор")
+                time.sleep(0.5 * 2 ** attempt)
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        if conn.status in (mgclient.CONN_STATUS_BAD, mgclient.CONN_STATUS_CLOSED):
+            return False
+        if time.monotonic() - idle_since < self.health_check_seconds:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("RETURN 1")
+            cursor.fetchall()
+            cursor.close()
+            if conn.status == mgclient.CONN_STATUS_IN_TRANSACTION:
+                conn.commit()
+            return True
+        except mgclient.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.lock:
+            self.created -= 1
+
+    def acquire(self):
+        if self.pid != os.getpid():
+            self.reset()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                conn, idle_since = self.idle.get_nowait()
+            except queue.Empty:
+                with self.lock:
+                    can_create = self.created < self.size
+                    if can_create:
+                        self.created += 1
+                if can_create:
+                    try:
+                        return self._connect()
+                    except Exception:
+                        with self.lock:
+                            self.created -= 1
+                        raise
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"нет свободного соединения с Memgraph за {self.timeout} с")
+                try:
+                    conn, idle_since = self.idle.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+            if self._is_healthy(conn, idle_since):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn):
+        """
+        Возвращает соединение в пул, откатив незавершённую транзакцию
+        """
+        if self.pid != os.getpid():
+            return
+        try:
+            if conn.status == mgclient.CONN_STATUS_IN_TRANSACTION:
+                conn.rollback()
+            conn.autocommit = False
+        except mgclient.Error:
+            self._discard(conn)
+            return
+        if conn.status != mgclient.CONN_STATUS_READY:
+            self._discard(conn)
+            return
+        self.idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except mgclient.Error:
+            # После ошибки протокола соединение может быть в неопределённом состоянии
+            self._discard(conn)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+
+memgraph_pool = MemgraphPool()
@@ -0,0 +1,127 @@
+# backend/migrate_embeddings.py
+"""
+Перевод эмбеддингов узлов Entity из base64-строк в нативные списки
+и перекодирование в формат хранения EMBEDDING_STORAGE (float32 / float16 / int8).
+
+Узлы читаются одним проходом через ленивый курсор (результат тянется пачками, а не
+перезапрашивается на каждую пачку), с --graph-id — через индекс по graph_id. Перезапись идёт
+по второму соединению небольшими пачками в отдельных транзакциях, поэтому граф можно
+мигрировать без остановки: поиск читает все форматы, а новые загрузки сразу пишут целевой.
+
+    python -m backend.migrate_embeddings [--graph-id 42] [--dtype int8] [--batch-size 1000] [--dry-run]
+"""
+import argparse
+import time
+
+import mgclient
+
+from backend.vector_codec import EMBEDDING_DTYPES, EMBEDDING_STORAGE, decode_vector, encode_embedding
+
+MIGRATION_BATCH_SIZE = 1000
+
+NEEDS_MIGRATION = """(valueType(e.embedding) = "STRING"
+       OR (e.embedding IS NOT NULL AND coalesce(e.embedding_dtype, "float32") <> $dtype))"""
+
+SELECT_LEGACY_QUERY = f"""
+MATCH (e:Entity)
+WHERE {NEEDS_MIGRATION}
+RETURN id(e), e.embedding, e.embedding_dtype, e.embedding_scale
+"""
+
+SELECT_GRAPH_LEGACY_QUERY = f"""
+MATCH (e:Entity {{graph_id: $graph_id}})
+WHERE {NEEDS_MIGRATION}
+RETURN id(e), e.embedding, e.embedding_dtype, e.embedding_scale
+"""
+
+# Повторная проверка формата не даёт перезаписать узел, который уже обновила свежая загрузка
+CONVERT_QUERY = """
+UNWIND $rows AS row
+MATCH (e:Entity)
+WHERE id(e) = row.id
+  AND (valueType(e.embedding) = "STRING" OR coalesce(e.embedding_dtype, "float32") <> $dtype)
+SET e.embedding = row.embedding,
+e.embedding_dtype = row.embedding_dtype,
+e.embedding_scale = row.embedding_scale
+"""
+
+# Узлы, созданные по связям, раньше получали пустую строку вместо эмбеддинга
+REMOVE_EMPTY_QUERY = """
+UNWIND $ids AS node_id
+MATCH (e:Entity)
+WHERE id(e) = node_id AND e.embedding = ''
+REMOVE e.embedding
+"""
+
+
+def migrate(read_conn, write_conn, graph_id: int = None, batch_size: int = MIGRATION_BATCH_SIZE,
+            dtype: str = EMBEDDING_STORAGE, dry_run: bool = False) -> dict:
+    """
+    read_conn — ленивое соединение (lazy=True): пока из него тянется результат,
+    другие запросы по нему идти не могут, поэтому запись идёт через write_conn
+    """
+    read_conn.autocommit = True
+    write_conn.autocommit = True
+    reader = read_conn.cursor()
+    cursor = write_conn.cursor()
+    stats = {"converted": 0, "emptied": 0, "failed": 0, "batches": 0}
+    if graph_id is None:
+        reader.execute(SELECT_LEGACY_QUERY, {"dtype": dtype})
+    else:
+        reader.execute(SELECT_GRAPH_LEGACY_QUERY, {"graph_id": graph_id, "dtype": dtype})
+    while True:
+        rows = reader.fetchmany(batch_size)
+        if not rows:
+            break
+
+        converted, empty_ids = [], []
+        for node_id, value, value_dtype, scale in rows:
+            if value == "":
+                empty_ids.append(node_id)
+                continue
+            try:
+                converted.append({"id": node_id, **encode_embedding(decode_vector(value, value_dtype, scale), dtype)})
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"Не удалось декодировать эмбеддинг узла {node_id}: {e}")
+
+        started = time.perf_counter()
+        if not dry_run:
+            if converted:
+                cursor.execute(CONVERT_QUERY, {"rows": converted, "dtype": dtype})
+            if empty_ids:
+                cursor.execute(REMOVE_EMPTY_QUERY, {"ids": empty_ids})
+        stats["converted"] += len(converted)
+        stats["emptied"] += len(empty_ids)
+        stats["batches"] += 1
+        print(
+            f"Пачка {stats['batches']}: {len(converted)} переведено, {len(empty_ids)} пустых, "
+            f"{(time.perf_counter() - started) * 1000:.1f} мс"
+        )
+    reader.close()
+    cursor.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграция эмбеддингов Entity в нативный формат хранения")
+    parser.add_argument("--graph-id", type=int, default=None, help="мигрировать только один граф")
+    parser.add_argument("--dtype", choices=EMBEDDING_DTYPES, default=EMBEDDING_STORAGE)
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument("--host", default="memgraph")
+    parser.add_argument("--port", type=int, default=7687)
+    parser.add_argument("--dry-run", action="store_true", help="только посчитать узлы, ничего не менять")
+    args = parser.parse_args()
+
+    read_conn = mgclient.connect(host=args.host, port=args.port, lazy=True)
+    write_conn = mgclient.connect(host=args.host, port=args.port)
+    try:
+        stats = migrate(read_conn, write_conn, args.graph_id, args.batch_size, args.dtype, args.dry_run)
+    finally:
+        read_conn.close()
+        write_conn.close()
+    print(f"Готово: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# backend/migrations.py
+"""
+Изменения схемы Postgres, которые не делает create_all: он создаёт индексы только вместе с новыми таблицами.
+
+Индексы строятся CONCURRENTLY, чтобы не блокировать запись в таблицы с историей.
+Прерванная сборка CONCURRENTLY оставляет индекс с indisvalid = false, который
+IF NOT EXISTS пропустил бы навсегда, поэтому такой индекс удаляется и строится заново.
+Запускается один раз при развёртывании, до старта gunicorn (см. docker-compose.yml);
+ошибка миграции завершает команду с ненулевым кодом.
+
+    python -m backend.migrations
+"""
+from sqlalchemy import text
+
+from backend import database, models
+
+MIGRATIONS = [
+    ("ix_search_history_user_created", "search_history (user_id, created_at, id)"),
+    ("ix_knowledge_graphs_owner_id", "knowledge_graphs (owner_id)"),
+]
+
+INDEX_VALID_QUERY = """
+SELECT i.indisvalid
+FROM pg_class c
+JOIN pg_index i ON i.indexrelid = c.oid
+WHERE c.relname = :name
+"""
+
+
+def ensure_index(conn, name: str, definition: str) -> str:
+    """
+    Создаёт индекс или пересоздаёт невалидный. Возвращает, что было сделано
+    """
+    valid = conn.execute(text(INDEX_VALID_QUERY), {"name": name}).scalar()
+    if valid:
+        return "уже есть"
+    action = "создан"
+    if valid is not None:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        action = "пересоздан (был невалидным)"
+    conn.execute(text(f"CREATE INDEX CONCURRENTLY {name} ON {definition}"))
+    return action
+
+
+def run_migrations(engine=database.engine):
+    # На пустой базе таблицы создаются здесь же, вместе с индексами из моделей
+    models.Base.metadata.create_all(bind=engine)
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, definition in MIGRATIONS:
+            print(f"Индекс {name}: {ensure_index(conn, name, definition)}")
+
+
+if __name__ == "__main__":
+    run_migrations()
+    print("Миграции применены")
@@ -1,5 +1,5 @@
 # backend/models.py
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -20,7 +20,7 @@ class KnowledgeGraph(Base):
 
     id = Column(Integer, primary_key=True)
     title = Column(String(100))
-    owner_id = Column(Integer, ForeignKey("users.id"))
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     owner = relationship("User", back_populates="graphs")
     queries = relationship("SearchHistory", back_populates="graph")
@@ -37,3 +37,8 @@ class SearchHistory(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
 
     graph = relationship("KnowledgeGraph", back_populates="queries")
+
+    # История пользователя читается страницами по (created_at, id) от новых к старым
+    __table_args__ = (
+        Index("ix_search_history_user_created", "user_id", "created_at", "id"),
+    )
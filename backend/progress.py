@@ -0,0 +1,86 @@
+# backend/progress.py
+"""
+Журнал прогресса задач в Redis Streams.
+
+Каждое событие канала graph_built:{task_id} или answer:{task_id} добавляется в поток
+progress:{канал} (не длиннее PROGRESS_STREAM_MAXLEN, живёт PROGRESS_STREAM_TTL_SECONDS
+после последнего события) и публикуется в одноимённый pub/sub канал для живых клиентов.
+Клиент, подключившийся позже, дочитывает поток начиная с известного ему event_id.
+
+    python -m backend.progress expire-legacy   # выставить TTL старым ключам-снимкам graph_built:* и answer:*
+"""
+import os
+import json
+import argparse
+
+import redis
+
+PROGRESS_STREAM_MAXLEN = int(os.getenv("PROGRESS_STREAM_MAXLEN", "1000"))
+PROGRESS_STREAM_TTL_SECONDS = int(os.getenv("PROGRESS_STREAM_TTL_SECONDS", str(24 * 60 * 60)))
+LEGACY_PATTERNS = ("graph_built:*", "answer:*")
+
+
+def progress_stream_key(channel: str) -> str:
+    return f"progress:{channel}"
+
+
+def stream_id(value) -> tuple:
+    """
+    ID записи потока "мс-номер" в виде кортежа для сравнения
+    """
+    if isinstance(value, bytes):
+        value = value.decode()
+    ms, _, seq = str(value).partition("-")
+    return int(ms), int(seq or 0)
+
+
+def decode_event(entry_id, fields: dict) -> dict:
+    """
+    Запись потока в сообщение WebSocket: прежние поля плюс event_id
+    """
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    raw = fields.get(b"data", fields.get("data"))
+    data = json.loads(raw)
+    data["event_id"] = entry_id
+    return data
+
+
+def publish_progress(redis_client, channel: str, data: dict) -> str:
+    key = progress_stream_key(channel)
+    pipe = redis_client.pipeline()
+    pipe.xadd(key, {"data": json.dumps(data)}, maxlen=PROGRESS_STREAM_MAXLEN, approximate=True)
+    pipe.expire(key, PROGRESS_STREAM_TTL_SECONDS)
+    event_id = pipe.execute()[0]
+    if isinstance(event_id, bytes):
+        event_id = event_id.decode()
+    redis_client.publish(channel, json.dumps({**data, "event_id": event_id}))
+    return event_id
+
+
+def expire_legacy_keys(redis_client, ttl: int = PROGRESS_STREAM_TTL_SECONDS) -> int:
+    """
+    Раньше снимки прогресса писались строковыми ключами без срока жизни
+    """
+    expired = 0
+    for pattern in LEGACY_PATTERNS:
+        for key in redis_client.scan_iter(match=pattern, count=1000, _type="string"):
+            if redis_client.ttl(key) == -1:
+                redis_client.expire(key, ttl)
+                expired += 1
+    return expired
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Журнал прогресса задач")
+    parser.add_argument("command", choices=["expire-legacy"])
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://redis:6379/0"))
+    parser.add_argument("--ttl", type=int, default=PROGRESS_STREAM_TTL_SECONDS)
+    args = parser.parse_args()
+
+    client = redis.Redis.from_url(args.redis_url)
+    print(f"TTL выставлен {expire_legacy_keys(client, args.ttl)} ключам")
+
+
+if __name__ == "__main__":
+    main()
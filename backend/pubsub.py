@@ -0,0 +1,141 @@
+# backend/pubsub.py
+"""
+Общий для процесса API слушатель Redis pub/sub.
+
+Одно соединение подписано по шаблонам на graph_built:* и answer:*, а сообщения
+раскладываются по очередям WebSocket-обработчиков, ждущих свой канал.
+Очереди ограничены PUBSUB_QUEUE_SIZE: если клиент не успевает читать,
+выбрасываются самые старые сообщения — это снимки прогресса, и последний важнее.
+
+Pub/sub не хранит сообщения, поэтому всё, что опубликовано без активной подписки
+(до первого psubscribe или пока соединение восстанавливается), теряется. После каждой
+успешной подписки в очереди кладётся RESYNC: обработчик дочитывает пропущенное
+из журнала прогресса в Redis Streams.
+"""
+import os
+import asyncio
+from contextlib import asynccontextmanager
+
+PUBSUB_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", "100"))
+PUBSUB_PATTERNS = ("graph_built:*", "answer:*")
+# Пауза перед переподключением после ошибки соединения с Redis
+PUBSUB_RECONNECT_SECONDS = float(os.getenv("PUBSUB_RECONNECT_SECONDS", "1"))
+# Сколько новый обработчик ждёт активной подписки, прежде чем читать журнал без неё
+PUBSUB_READY_TIMEOUT_SECONDS = float(os.getenv("PUBSUB_READY_TIMEOUT_SECONDS", "5"))
+
+# Маркер в очереди обработчика: подписка (пере)установлена, пропущенное надо дочитать из журнала
+RESYNC = object()
+
+
+class PubSubDispatcher:
+    def __init__(self, redis_client, patterns=PUBSUB_PATTERNS, queue_size: int = PUBSUB_QUEUE_SIZE):
+        self.redis_client = redis_client
+        self.patterns = patterns
+        self.queue_size = queue_size
+        self.subscribers = {}
+        self.dropped = 0
+        self.ready = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        """
+        Запускает фоновое чтение в текущем цикле событий; повторный вызов ничего не делает
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def wait_ready(self, timeout: float = PUBSUB_READY_TIMEOUT_SECONDS) -> bool:
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self):
+        self.ready.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        """
+        Очередь сообщений канала на время блока. Блок начинается, когда подписка в Redis
+        активна, а обработчик читает журнал уже после этого, поэтому событие между журналом
+        и подпиской не теряется. Если Redis недоступен дольше PUBSUB_READY_TIMEOUT_SECONDS,
+        блок начинается без подписки, а после её установки в очередь придёт RESYNC
+        """
+        self.start()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(channel, set()).add(queue)
+        try:
+            if not await self.wait_ready():
+                print(f"Подписка Redis pub/sub не готова, канал {channel} ждёт переподключения")
+            yield queue
+        finally:
+            waiting = self.subscribers.get(channel)
+            if waiting is not None:
+                waiting.discard(queue)
+                if not waiting:
+                    del self.subscribers[channel]
+
+    def _put(self, queue: asyncio.Queue, item):
+        if queue.full():
+            dropped = queue.get_nowait()
+            self.dropped += 1
+            if dropped is RESYNC:
+                # Маркер важнее снимка: сообщение уже лежит в журнале и будет дочитано вместе с остальными
+                item = RESYNC
+        queue.put_nowait(item)
+
+    def dispatch(self, channel: str, data):
+        for queue in self.subscribers.get(channel, ()):
+            self._put(queue, data)
+
+    def resync(self):
+        for queues in self.subscribers.values():
+            for queue in queues:
+                self._put(queue, RESYNC)
+
+    async def _run(self):
+        while True:
+            pubsub = self.redis_client.pubsub()
+            try:
+                await pubsub.psubscribe(*self.patterns)
+                # Подтверждения psubscribe значат, что подписка активна и новые публикации дойдут
+                confirmed = 0
+                while confirmed < len(self.patterns):
+                    message = await pubsub.get_message(timeout=PUBSUB_RECONNECT_SECONDS)
+                    if message is not None and message["type"] == "psubscribe":
+                        confirmed += 1
+                self.ready.set()
+                self.resync()
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    self.dispatch(channel, message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ошибка подписки Redis pub/sub: {e}. Переподключение")
+                await asyncio.sleep(PUBSUB_RECONNECT_SECONDS)
+            finally:
+                self.ready.clear()
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self.subscribers),
+            "subscribers": sum(len(queues) for queues in self.subscribers.values()),
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,243 @@
+# backend/retrieval.py
+"""
+Поиск окрестности узлов в памяти воркера вместо Cypher-запроса (a)-[*1..2]-(b).
+
+Для каждого графа кэшируется симметричная CSR-матрица смежности (scipy.sparse).
+Расширение от затравочных узлов — произведения разреженной матрицы на вектор,
+причём хабы раздают не больше RETRIEVAL_MAX_FANOUT соседей (с наибольшим PageRank),
+иначе на плотных графах два хопа от хаба захватывают почти весь граф.
+Кандидаты ранжируются по близости к запросу и персонализированному PageRank,
+стартующему из затравочных узлов с весами их близости.
+
+Сохранённый в узлах глобальный PageRank (backend.centrality) нужен в двух режимах:
+RETRIEVAL_RANKING=pagerank — как вклад центральности в оценку кандидата;
+RETRIEVAL_RANKING=ppr (по умолчанию) — только чтобы выбрать, каких соседей хаба оставить
+при RETRIEVAL_MAX_FANOUT > 0. При ppr и RETRIEVAL_MAX_FANOUT=0 он не используется,
+и загрузка не ставит его пересчёт.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse as sp
+
+from backend.centrality import PAGERANK_DAMPING, centrality_version_key
+from backend.vector_index import get_graph_version
+
+RETRIEVAL_MAX_FANOUT = int(os.getenv("RETRIEVAL_MAX_FANOUT", "50"))
+RETRIEVAL_HOPS = int(os.getenv("RETRIEVAL_HOPS", "2"))
+RETRIEVAL_PPR_ITER = int(os.getenv("RETRIEVAL_PPR_ITER", "30"))
+RETRIEVAL_PPR_TOL = float(os.getenv("RETRIEVAL_PPR_TOL", "1e-6"))
+# "ppr" — персонализированный PageRank от затравочных узлов, "pagerank" — сохранённый глобальный PageRank
+RETRIEVAL_RANKING = os.getenv("RETRIEVAL_RANKING", "ppr")
+# Бюджет памяти на матрицы смежности всех графов в одном процессе воркера
+ADJACENCY_CACHE_MAX_BYTES = int(os.getenv("ADJACENCY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def uses_stored_pagerank(ranking: str = RETRIEVAL_RANKING, max_fanout: int = RETRIEVAL_MAX_FANOUT) -> bool:
+    return ranking == "pagerank" or max_fanout > 0
+
+
+NODES_QUERY = """
+MATCH (e:Entity {graph_id: $graph_id})
+RETURN e.name, e.pagerank
+"""
+
+EDGES_QUERY = """
+MATCH (a:Entity {graph_id: $graph_id})-[]->(b:Entity {graph_id: $graph_id})
+RETURN a.name, b.name
+"""
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Позиции k наибольших значений по убыванию: argpartition вместо полной сортировки
+    """
+    k = min(k, len(scores))
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+class GraphAdjacency:
+    def __init__(self, graph_id: int, version: tuple, names: list, pagerank: np.ndarray,
+                 sources: np.ndarray, targets: np.ndarray, max_fanout: int = RETRIEVAL_MAX_FANOUT):
+        self.graph_id = graph_id
+        self.version = version
+        self.names = names
+        self.name_to_idx = {name: idx for idx, name in enumerate(names)}
+        self.pagerank = pagerank
+        size = len(names)
+
+        # Неориентированная матрица без кратных рёбер и петель
+        keep = sources != targets
+        rows = np.concatenate([sources[keep], targets[keep]])
+        cols = np.concatenate([targets[keep], sources[keep]])
+        matrix = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(size, size))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1.0
+        self.matrix = matrix
+        self.fanout = self._cap_fanout(matrix, max_fanout)
+
+    def _cap_fanout(self, matrix: sp.csr_matrix, max_fanout: int) -> sp.csr_matrix:
+        """
+        Матрица расширения: из каждого узла не больше max_fanout рёбер к соседям с наибольшим PageRank.
+        Возвращается транспонированной, чтобы шаг расширения был fanout @ frontier
+        """
+        degree = np.diff(matrix.indptr)
+        if max_fanout <= 0 or degree.max(initial=0) <= max_fanout:
+            return matrix.T.tocsr()
+        rows = np.repeat(np.arange(matrix.shape[0]), degree)
+        order = np.lexsort((-self.pagerank[matrix.indices], rows))
+        rank_in_row = np.arange(len(order)) - matrix.indptr[rows]
+        keep = order[rank_in_row < max_fanout]
+        capped = sp.csr_matrix(
+            (matrix.data[keep], (rows[keep], matrix.indices[keep])), shape=matrix.shape
+        )
+        return capped.T.tocsr()
+
+    @property
+    def nbytes(self) -> int:
+        total = self.pagerank.nbytes
+        for matrix in (self.matrix, self.fanout):
+            total += matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+        return total
+
+    def expand(self, seeds: np.ndarray, hops: int = RETRIEVAL_HOPS) -> np.ndarray:
+        """
+        Узлы на расстоянии до hops от затравочных (включая их самих)
+        """
+        reached = np.zeros(len(self.names), dtype=np.float32)
+        reached[seeds] = 1.0
+        frontier = reached
+        for _ in range(hops):
+            frontier = (self.fanout @ frontier > 0).astype(np.float32)
+            reached = np.maximum(reached, frontier)
+        return np.flatnonzero(reached)
+
+    def personalized_pagerank(self, nodes: np.ndarray, personalization: np.ndarray,
+                              damping: float = PAGERANK_DAMPING, max_iter: int = RETRIEVAL_PPR_ITER,
+                              tol: float = RETRIEVAL_PPR_TOL) -> np.ndarray:
+        """
+        PageRank на подграфе nodes с телепортацией в распределение personalization
+        """
+        total = personalization.sum()
+        if total <= 0:
+            personalization = np.full(len(nodes), 1.0 / max(len(nodes), 1))
+        else:
+            personalization = personalization / total
+        sub = self.matrix[nodes][:, nodes]
+        degree = np.asarray(sub.sum(axis=1)).ravel()
+        dangling = degree == 0
+        inv_degree = np.divide(1.0, degree, out=np.zeros_like(degree), where=~dangling)
+        transition = (sp.diags(inv_degree) @ sub).T.tocsr()
+
+        scores = personalization.copy()
+        for _ in range(max_iter):
+            updated = damping * (transition @ scores + scores[dangling].sum() * personalization) \
+                + (1.0 - damping) * personalization
+            converged = np.abs(updated - scores).sum() < tol
+            scores = updated
+            if converged:
+                break
+        return scores
+
+
+def load_adjacency(conn, graph_id: int, version: tuple) -> GraphAdjacency:
+    cursor = conn.cursor()
+    try:
+        cursor.execute(NODES_QUERY, {"graph_id": graph_id})
+        nodes = cursor.fetchall()
+        cursor.execute(EDGES_QUERY, {"graph_id": graph_id})
+        edges = cursor.fetchall()
+    finally:
+        cursor.close()
+    names = [name for name, _ in nodes]
+    pagerank = np.array([score if isinstance(score, (int, float)) else 0.0 for _, score in nodes], dtype=np.float32)
+    name_to_idx = {name: idx for idx, name in enumerate(names)}
+    pairs = np.array(
+        [(name_to_idx[a], name_to_idx[b]) for a, b in edges if a in name_to_idx and b in name_to_idx],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    return GraphAdjacency(graph_id, version, names, pagerank, pairs[:, 0], pairs[:, 1])
+
+
+class AdjacencyCache:
+    """
+    LRU-кэш GraphAdjacency по graph_id. Матрица перечитывается целиком, когда меняется
+    версия графа или пересчитан PageRank (от него зависит выбор соседей хабов)
+    """
+
+    def __init__(self, max_bytes: int = ADJACENCY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.graphs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, graph_id: int, conn, redis_client) -> GraphAdjacency:
+        with self.lock:
+            centrality_version = redis_client.get(centrality_version_key(graph_id))
+            version = (get_graph_version(redis_client, graph_id), int(centrality_version or 0))
+            adjacency = self.graphs.get(graph_id)
+            if adjacency is None or adjacency.version != version:
+                adjacency = load_adjacency(conn, graph_id, version)
+            self.graphs[graph_id] = adjacency
+            self.graphs.move_to_end(graph_id)
+            total = sum(item.nbytes for item in self.graphs.values())
+            while total > self.max_bytes and len(self.graphs) > 1:
+                _, evicted = self.graphs.popitem(last=False)
+                total -= evicted.nbytes
+            return adjacency
+
+
+adjacency_cache = AdjacencyCache()
+
+
+def rank_nodes(index, adjacency: GraphAdjacency, query_vec: np.ndarray, nearest_idx: np.ndarray,
+               rerank_sims: dict = None, seeds: int = 10, nearest: int = 20, top: int = 20,
+               alpha: float = 0.7, beta: float = 0.3) -> list:
+    """
+    Имена top узлов по alpha*similarity + beta*centrality среди ближайших по эмбеддингу
+    и окрестности первых seeds из них
+    """
+    rerank_sims = rerank_sims or {}
+    seed_names = [index.names[i] for i in nearest_idx[:seeds]]
+    seed_pos = np.array([adjacency.name_to_idx[name] for name in seed_names if name in adjacency.name_to_idx], dtype=np.int64)
+    expanded = adjacency.expand(seed_pos) if len(seed_pos) else np.zeros(0, dtype=np.int64)
+
+    # Кандидаты — узлы с эмбеддингом: ближайшие и найденные расширением
+    candidate_idx = dict.fromkeys(nearest_idx[:nearest].tolist())
+    for pos in expanded:
+        idx = index.name_to_idx.get(adjacency.names[pos])
+        if idx is not None:
+            candidate_idx[idx] = None
+    candidate_idx = np.fromiter(candidate_idx, dtype=np.int64, count=len(candidate_idx))
+    candidate_names = [index.names[i] for i in candidate_idx]
+
+    sims = index.similarities(query_vec, candidate_idx)
+    if rerank_sims:
+        sims = np.array([rerank_sims.get(name, sim) for name, sim in zip(candidate_names, sims)], dtype=np.float32)
+
+    # Позиции кандидатов в матрице смежности (-1 — узла нет в матрице)
+    candidate_pos = np.array([adjacency.name_to_idx.get(name, -1) for name in candidate_names], dtype=np.int64)
+    centrality = np.zeros(len(candidate_idx), dtype=np.float32)
+    if RETRIEVAL_RANKING == "pagerank":
+        known = candidate_pos >= 0
+        centrality[known] = adjacency.pagerank[candidate_pos[known]]
+    elif len(expanded):
+        # Телепортация только в затравочные узлы, с весом их близости к запросу
+        seed_sims = np.zeros(len(adjacency.names), dtype=np.float64)
+        known = candidate_pos >= 0
+        seed_sims[candidate_pos[known]] = np.maximum(sims[known], 0.0)
+        personalization = np.zeros(len(expanded), dtype=np.float64)
+        is_seed = np.isin(expanded, seed_pos)
+        personalization[is_seed] = seed_sims[expanded[is_seed]]
+        ppr = adjacency.personalized_pagerank(expanded, personalization)
+        ppr /= max(ppr.max(), 1e-12)
+        slots = np.clip(np.searchsorted(expanded, candidate_pos), 0, len(expanded) - 1)
+        in_subgraph = known & (expanded[slots] == candidate_pos)
+        centrality[in_subgraph] = ppr[slots[in_subgraph]]
+
+    scores = alpha * sims + beta * centrality
+    return [candidate_names[i] for i in top_k_indices(scores, top)]
@@ -0,0 +1,127 @@
+# backend/schema.py
+"""
+Индексы Memgraph для узлов Entity.
+
+Все запросы проекта ищут узлы по graph_id (и имени), поэтому без индекса MERGE и MATCH
+просматривают узлы всех графов. ensure_indexes вызывается при старте воркера и API
+и создаёт недостающие индексы; повторный вызов ничего не делает.
+
+    python -m backend.schema check     # код выхода 1, если индексов не хватает
+    python -m backend.schema ensure
+"""
+import sys
+import argparse
+
+import mgclient
+
+# Составной индекс (graph_id, name) есть не во всех версиях Memgraph,
+# тогда вместо него создаётся индекс по name
+ENTITY_INDEXES = [
+    ("Entity", ("graph_id",), None),
+    ("Entity", ("graph_id", "name"), ("Entity", ("name",))),
+]
+
+
+def index_query(label: str, properties: tuple) -> str:
+    return f"CREATE INDEX ON :{label}({', '.join(properties)})"
+
+
+def existing_indexes(conn) -> set:
+    """
+    Пары (метка, свойства) из SHOW INDEX INFO
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SHOW INDEX INFO")
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    indexes = set()
+    for _, label, properties, *_ in rows:
+        if properties is None:
+            properties = ()
+        elif isinstance(properties, str):
+            properties = (properties,)
+        indexes.add((label, tuple(properties)))
+    return indexes
+
+
+def missing_indexes(conn) -> list:
+    existing = existing_indexes(conn)
+    missing = []
+    for label, properties, fallback in ENTITY_INDEXES:
+        if (label, properties) in existing:
+            continue
+        if fallback is not None and fallback in existing:
+            continue
+        missing.append((label, properties, fallback))
+    return missing
+
+
+def ensure_indexes(conn) -> list:
+    """
+    Создаёт недостающие индексы и возвращает созданные. Индексы в Memgraph создаются
+    только вне явной транзакции, поэтому соединение переводится в autocommit
+    """
+    conn.autocommit = True
+    created = []
+    for label, properties, fallback in missing_indexes(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(index_query(label, properties))
+            created.append((label, properties))
+        except mgclient.DatabaseError as e:
+            if fallback is None:
+                raise
+            print(f"Индекс :{label}({', '.join(properties)}) не поддерживается ({e}), создаём :{fallback[0]}({', '.join(fallback[1])})")
+            cursor.execute(index_query(*fallback))
+            created.append(fallback)
+        finally:
+            cursor.close()
+    for label, properties in created:
+        print(f"Создан индекс Memgraph :{label}({', '.join(properties)})")
+    return created
+
+
+def ensure_indexes_safely(host: str = "memgraph", port: int = 7687):
+    """
+    Для старта сервисов: недоступный Memgraph не должен мешать запуску, индексы создаст следующий старт
+    """
+    try:
+        conn = mgclient.connect(host=host, port=port)
+    except Exception as e:
+        print(f"Memgraph недоступен, индексы не проверены: {e}")
+        return
+    try:
+        ensure_indexes(conn)
+    except Exception as e:
+        print(f"Ошибка при создании индексов Memgraph: {e}")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Индексы Memgraph для узлов Entity")
+    parser.add_argument("command", choices=["check", "ensure"])
+    parser.add_argument("--host", default="memgraph")
+    parser.add_argument("--port", type=int, default=7687)
+    args = parser.parse_args()
+
+    conn = mgclient.connect(host=args.host, port=args.port)
+    try:
+        if args.command == "ensure":
+            ensure_indexes(conn)
+            return
+        conn.autocommit = True
+        missing = missing_indexes(conn)
+    finally:
+        conn.close()
+    for label, properties, _ in missing:
+        print(f"Нет индекса :{label}({', '.join(properties)})")
+    if missing:
+        sys.exit(1)
+    print("Все индексы на месте")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,140 +1,590 @@
 # backend/tasks.py
-from celery import Celery
+from celery import chord
+from celery.signals import worker_init, worker_process_init
 from backend import giga, crud, database
+from backend.graph_writer import BulkWriter, UPSERT_ENTITIES_QUERY, sanitize_rel_type, write_relations
+from backend.vector_index import index_cache, get_graph_version, mark_graph_updated
+from backend.vector_codec import encode_embedding
+from backend.celery_app import celery_app, PROCESS_TEXT_TASK, PROCESS_DOCUMENT_TASK, SEARCH_GRAPH_TASK
+from backend import embeddings
+from backend.schema import ensure_indexes_safely
+from backend.progress import publish_progress
+from backend.memgraph_pool import memgraph_pool
+from backend.documents import open_pages, remove_upload, KIND_URL
+from backend.chunking import count_chunks, iter_chunks, iter_page_chunks, split_text
+from backend.extraction_cache import ExtractionCache
+from backend.answer_cache import AnswerCache
+from backend.retrieval import adjacency_cache, rank_nodes, uses_stored_pagerank
+from backend.centrality import (
+    CENTRALITY_DEBOUNCE_SECONDS, INGEST_ACTIVE_TTL_SECONDS, centrality_pending_key, centrality_version_key,
+    compute_centrality, ingest_active_key,
+)
 from sqlalchemy.orm import Session
-import mgclient
 import os
-from gqlalchemy import Memgraph
 import json 
 import redis
-from sentence_transformers import SentenceTransformer
+import queue
+import threading
+from contextlib import contextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
-import base64
-import networkx as nx
 from crud import get_graph_by_id
 
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
-mg = Memgraph(host='memgraph', port=7687)
-redis_client = redis.Redis(host='redis', port=6379, db=0)
-
-embedding_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-
-
-celery_app = Celery(
-    'tasks',
-    broker='redis://redis:6379/0',            # очередь задач
-    backend='redis://redis:6379/1',           # <- это нужно для хранения результатов
-)
-def get_memgraph_connection():
-    return mgclient.connect(host="memgraph", port=7687)
+# Клиенты создаются лениво: модуль импортируется воркером Celery,
+# но тяжёлые объекты появляются только при первом использовании
+_redis_client = None
+
+# Размер батча для encode модели эмбеддингов и размер окна сущностей,
+# которые векторизуются за один проход (ограничивает память на больших документах)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_WINDOW = int(os.getenv("EMBEDDING_WINDOW", "2048"))
+
+# Сколько запросов к GigaChat по чанкам одного документа держим в полёте одновременно.
+# По умолчанию 1: скоуп GIGACHAT_API_PERS ограничен по частоте, параллельность включается явно
+GIGACHAT_CONCURRENCY = int(os.getenv("GIGACHAT_CONCURRENCY", "1"))
+
+# Режим загрузки документа: "local" — весь документ в одной задаче,
+# "distributed" — извлечение по чанкам раскидывается по воркерам через chord,
+# "pipelined" — извлечение, векторизация и запись идут потоком, граф заполняется по ходу загрузки
+INGEST_MODE = os.getenv("INGEST_MODE", "local")
+# В режиме pipelined узлы пишутся в Memgraph окнами по столько чанков
+PIPELINE_WINDOW_CHUNKS = int(os.getenv("PIPELINE_WINDOW_CHUNKS", "4"))
+# Сколько извлечённых, но ещё не записанных чанков может ждать в очереди между этапами
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+# Сколько чанков обрабатывает одна подзадача извлечения в режиме distributed
+CHUNKS_PER_SUBTASK = int(os.getenv("CHUNKS_PER_SUBTASK", "4"))
+# Время жизни счётчика прогресса распределённой загрузки
+PROGRESS_TTL_SECONDS = int(os.getenv("PROGRESS_TTL_SECONDS", str(24 * 60 * 60)))
+
+# Сколько лучших кандидатов квантованного поиска (float16/int8) пересчитывается по заново
+# вычисленным эмбеддингам их текстов, 0 — не пересчитывать (по умолчанию). Пересчёт прогоняет
+# модель на EMBEDDING_RERANK_TOP текстах в каждом поиске: это десятки-сотни мс CPU на запрос.
+# Точными float32 такие вектора будут только с EMBEDDING_BACKEND=torch или onnx, с onnx-int8
+# они сами приближённые. Потеря качества от int8 с масштабом на вектор обычно мала и без пересчёта
+EMBEDDING_RERANK_TOP = int(os.getenv("EMBEDDING_RERANK_TOP", "0"))
+
+def get_redis_client():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(host='redis', port=6379, db=0)
+    return _redis_client
+
+@worker_init.connect
+def ensure_memgraph_indexes(**kwargs):
+    ensure_indexes_safely()
+
+@worker_init.connect
+def preload_embedding_model(**kwargs):
+    # PyTorch-модель грузится в главном процессе воркера до форка, как и раньше при импорте,
+    # чтобы дочерние процессы делили её память
+    if embeddings.preload_before_fork():
+        embeddings.get_backend()
+
+@worker_process_init.connect
+def init_embedding_backend(**kwargs):
+    embeddings.get_backend()
+
+# Ответы GigaChat по чанкам, общий для всех воркеров кэш в Redis
+extraction_cache = ExtractionCache(get_redis_client)
+# Ответы на поисковые запросы по версии графа и эмбеддингу запроса
+answer_cache = AnswerCache(get_redis_client)
+
+@worker_process_init.connect
+def reset_memgraph_pool(**kwargs):
+    # Каждый дочерний процесс prefork открывает собственные соединения
+    memgraph_pool.reset()
+
+def get_embeddings(texts, batch_size: int = EMBEDDING_BATCH_SIZE):
+    """
+    Пакетное вычисление эмбеддингов выбранным бэкендом (EMBEDDING_BACKEND): один вызов encode на список текстов
+    """
+    return embeddings.get_backend().encode(list(texts), batch_size=batch_size)
+
+def normalize_entity(ent: dict) -> dict:
+    """
+    Приводит сущность из ответа GigaChat к строке для записи в граф
+    """
+    # Проверка и нормализация типа
+    raw_type = ent.get("type", "Other")
+    if isinstance(raw_type, list):
+        clean_type = raw_type[0] if raw_type else "Other"
+    elif isinstance(raw_type, str):
+        clean_type = raw_type
+    else:
+        clean_type = str(raw_type)
+    text = ent["desc"] or ent["name"]
+    if not isinstance(text, str):
+        raise ValueError(f"нет текста для эмбеддинга: {ent!r}")
+    return {"name": ent["name"], "desc": ent["desc"], "type": clean_type, "text": text}
+
+def group_relations(entities: list) -> dict:
+    """
+    Собирает связи всех сущностей и группирует их по очищенному типу связи
+    """
+    grouped = {}
+    for ent in entities:
+        if not isinstance(ent, dict) or not isinstance(ent.get("relations"), list):
+            continue
+        for rel in ent["relations"]:
+            try:
+                rel_type = sanitize_rel_type(rel["type"])
+                grouped.setdefault(rel_type, []).append({"source": ent["name"], "target": rel["target"]})
+            except Exception as e:
+                print(f"Ошибка при создании отношения {rel}: {e}")
+    return grouped
+
+def embed_entities(rows: list, window: int = EMBEDDING_WINDOW, batch_size: int = EMBEDDING_BATCH_SIZE):
+    """
+    Этап векторизации: идёт по сущностям окнами и на каждое окно отдаёт список пар (строка, вектор)
+    """
+    for start in range(0, len(rows), window):
+        batch = rows[start:start + window]
+        vectors = get_embeddings([row["text"] for row in batch], batch_size=batch_size)
+        yield list(zip(batch, vectors))
+
+def publish_answer(task_id: str, query: str, answer: str, graph_id: int, user_id: int) -> dict:
+    # Сохраняем ответ в историю
+    db: Session = next(database.get_db())
+    crud.save_query_result(db, query, answer, graph_id, user_id)
+    db.close()
+    print('ответ от гигачата в celery', answer)
+    result = {"status": "SUCCESS", "answer": answer}
+    publish_progress(get_redis_client(), f"answer:{task_id}", result)
+    return result
+
+def rerank_similarities(cursor, graph_id: int, names: list, query_vec) -> dict:
+    """
+    Близость запроса к узлам по эмбеддингам, заново вычисленным по тем же текстам, что и при загрузке.
+    Точность — как у текущего EMBEDDING_BACKEND, а не хранимого формата
+    """
+    cursor.execute(
+        """
+        UNWIND $names AS name
+        MATCH (e:Entity {graph_id: $graph_id})
+        WHERE e.name = name
+        RETURN e.name, e.description
+        """,
+        {"graph_id": graph_id, "names": names}
+    )
+    texts = {}
+    for name, desc in cursor.fetchall():
+        text = desc or name
+        if isinstance(text, str):
+            texts[name] = text
+    if not texts:
+        return {}
+    vectors = get_embeddings(list(texts.values()))
+    return dict(zip(texts.keys(), (vectors @ query_vec).tolist()))
+
+def publish_graph_status(task_id: str, data: dict):
+    publish_progress(get_redis_client(), f"graph_built:{task_id}", data)
+
+def extract_chunk(chunk: str, is_tatar: bool):
+    """
+    Извлечение сущностей и связей из одного чанка через GigaChat.
+    Сначала проверяется кэш извлечения: одинаковые чанки в LLM повторно не отправляются
+    """
+    cached = extraction_cache.get(chunk, is_tatar)
+    if cached is not None:
+        return cached
+    response = giga.extract_knowledge_graph(chunk, is_tatar)
+    raw = response.strip('`').replace('json\n', '', 1)
+    graph_list = json.loads(raw)
+    extraction_cache.put(chunk, is_tatar, graph_list)
+    return graph_list
+
+def extract_chunks(chunks: list, is_tatar: bool, on_chunk_done=None, concurrency: int = GIGACHAT_CONCURRENCY) -> list:
+    """
+    Извлекает сущности из всех чанков, держа в полёте до concurrency запросов к GigaChat.
+    Чанки завершаются в произвольном порядке, но результаты склеиваются в порядке чанков,
+    поэтому граф получается тем же, что и при последовательной обработке.
+    on_chunk_done(failed) вызывается на каждый чанк; failed — чанк не удалось извлечь после повторов
+    """
+    results = [[] for _ in chunks]
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(extract_chunk, chunk, is_tatar): idx for idx, chunk in enumerate(chunks)}
+        # as_completed отдаёт результаты в этот поток, так что счётчик прогресса меняется только здесь
+        for future in as_completed(futures):
+            idx = futures[future]
+            failed = False
+            try:
+                results[idx] = list(future.result())
+            except Exception as e:
+                failed = True
+                print(f"Ошибка при обработке чанка {idx+1}: {e}")
+            finally:
+                if on_chunk_done:
+                    on_chunk_done(failed)
 
-def encode_vector(vector):
-    return base64.b64encode(np.array(vector, dtype=np.float32).tobytes()).decode()
+    all_entities = []
+    for graph_list in results:
+        all_entities.extend(graph_list)
+    return all_entities
+
+def write_entities(conn, graph_id: int, entities: list) -> list:
+    """
+    Векторизация сущностей и запись узлов и связей в Memgraph. Возвращает имена записанных узлов
+    """
+    rows = []
+    for ent in entities:
+        try:
+            rows.append(normalize_entity(ent))
+        except Exception as e:
+            print(f"Ошибка при создании узла: {e}")
 
+    writer = BulkWriter(conn, UPSERT_ENTITIES_QUERY, {"graph_id": graph_id}, label="узлы")
+    for window in embed_entities(rows):
+        for row, emb in window:
+            writer.add({"name": row["name"], "desc": row["desc"], "type": row["type"], **encode_embedding(emb)})
+        # Следующее окно векторизуется без открытой транзакции
+        writer.flush()
+    writer.close()
 
-def get_embedding(text: str):
-    return embedding_model.encode(text, normalize_embeddings=True).tolist()
+    # Связи пишутся после узлов, пачками по типу связи. Недостающие узлы создаются автоматически,
+    # потому что GigaChat часто упоминает связи с сущностями, которые не описывает отдельно, и тогда узел b не создаётся на предыдущем этапе (узлы с описанием и эмбеддингами).
+    write_relations(conn, graph_id, group_relations(entities))
+    return [row["name"] for row in rows]
+
+def publish_graph_update(graph_id: int, names: list, final: bool = True):
+    # Новая версия графа: векторные индексы воркеров дочитают только эти узлы,
+    # а закэшированные ответы прошлой версии больше не выдаются.
+    # PageRank пересчитывается только после последней записи загрузки (final)
+    version = mark_graph_updated(get_redis_client(), graph_id, names)
+    answer_cache.drop_version(graph_id, version - 1)
+    if final:
+        schedule_centrality(graph_id)
+
+def build_graph(graph_id: int, all_entities: list):
+    """
+    Векторизация сущностей и запись узлов и связей в Memgraph
+    """
+    with memgraph_pool.connection() as conn:
+        names = write_entities(conn, graph_id, all_entities)
+    publish_graph_update(graph_id, names)
+
+def schedule_centrality(graph_id: int):
+    """
+    Откладывает пересчёт PageRank графа на CENTRALITY_DEBOUNCE_SECONDS.
+    Пока пересчёт ждёт в очереди, новые загрузки не ставят ещё один — он прочитает и их узлы.
+    Если поиск не читает сохранённый PageRank (см. backend.retrieval), пересчёт не нужен
+    """
+    if not uses_stored_pagerank():
+        return
+    if get_redis_client().set(centrality_pending_key(graph_id), 1, nx=True, ex=CENTRALITY_DEBOUNCE_SECONDS * 10):
+        compute_centrality_task.apply_async(args=[graph_id], countdown=CENTRALITY_DEBOUNCE_SECONDS)
+
+@contextmanager
+def graph_ingest(graph_id: int):
+    """
+    Отмечает потоковую загрузку графа, а после неё ставит пересчёт PageRank
+    """
+    key = ingest_active_key(graph_id)
+    pipe = get_redis_client().pipeline()
+    pipe.incr(key)
+    pipe.expire(key, INGEST_ACTIVE_TTL_SECONDS)
+    pipe.execute()
+    try:
+        yield
+    finally:
+        get_redis_client().decr(key)
+        schedule_centrality(graph_id)
+
+@celery_app.task
+def compute_centrality_task(graph_id: int):
+    # Флаг снимается до чтения графа: загрузка, закончившаяся во время пересчёта, поставит следующий
+    get_redis_client().delete(centrality_pending_key(graph_id))
+    # Пересчёт переписал бы pagerank всех узлов, в которые сейчас пишет загрузка.
+    # Она сама поставит пересчёт, когда закончится
+    if int(get_redis_client().get(ingest_active_key(graph_id)) or 0) > 0:
+        return {"status": "postponed", "graph_id": graph_id}
+    version = get_graph_version(get_redis_client(), graph_id)
+    done_version = get_redis_client().get(centrality_version_key(graph_id))
+    if done_version is not None and int(done_version) >= version:
+        return {"status": "skipped", "graph_id": graph_id}
+
+    with memgraph_pool.connection() as conn:
+        nodes = compute_centrality(conn, graph_id)
+    get_redis_client().set(centrality_version_key(graph_id), version)
+    return {"status": "success", "graph_id": graph_id, "nodes": nodes}
+
+# acks_late: задача подтверждается после выполнения, и если воркер упал посреди загрузки,
+# документ достанется другому. Повтор безопасен — сущности и связи пишутся через MERGE
+@celery_app.task(bind=True, name=PROCESS_TEXT_TASK, acks_late=True)
+def process_text_task(self, text: str, graph_id: int, user_id: int):
+    # Клиент ждёт SUCCESS или FAILURE в graph_built:{task_id}, поэтому ошибка публикуется до повторного raise
+    try:
+        return ingest_text(self.request.id, text, graph_id)
+    except Exception as e:
+        publish_graph_failure(self.request.id, graph_id, e)
+        raise
 
-def split_text_by_overlap(text: str, chunk_size: int = 1000, overlap: int = 150):
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = min(start + chunk_size, len(text))
-        chunks.append(text[start:end])
-        start += chunk_size - overlap
-    return chunks
+def publish_graph_failure(task_id: str, graph_id: int, exc: Exception):
+    print(f"Ошибка загрузки {task_id}: {exc}")
+    publish_graph_status(task_id, {"status": "FAILURE", "graph_id": graph_id, "error": str(exc)})
 
-@celery_app.task(bind=True)
-def process_text_task(self, text: str, graph_id: int, user_id: int):
+def ingest_text(task_id: str, text: str, graph_id: int):
 
     db: Session = next(database.get_db())
     graph = get_graph_by_id(db, graph_id)
     is_tatar = graph.is_tatar if graph else False
     db.close()
-    
-    chunks = split_text_by_overlap(text, chunk_size=1000, overlap=150)
+
+    if INGEST_MODE == "pipelined":
+        return ingest_pipelined(task_id, graph_id, is_tatar, {"chunks_total": count_chunks(text)},
+                                chunks=iter_chunks(text))
+
+    chunks = split_text(text)
     total_chunks = len(chunks)
+
+    if INGEST_MODE == "distributed" and total_chunks > CHUNKS_PER_SUBTASK:
+        return dispatch_distributed_ingest(task_id, chunks, graph_id, is_tatar)
+
     processed_chunks = 0
+    failed_chunks = 0
+
+    def on_chunk_done(failed: bool):
+        nonlocal processed_chunks, failed_chunks
+        processed_chunks += 1
+        failed_chunks += failed
+        publish_graph_status(task_id, {
+            "status": "В процессе",
+            "graph_id": graph_id,
+            "chunks_total": total_chunks,
+            "chunks_done": processed_chunks,
+            "chunks_failed": failed_chunks
+        })
+
+    all_entities = extract_chunks(chunks, is_tatar, on_chunk_done)
+    build_graph(graph_id, all_entities)
+
+    publish_graph_status(task_id, {
+        "status": "SUCCESS",
+        "graph_id": graph_id,
+        "chunks_total": total_chunks,
+        "chunks_done": processed_chunks,
+        "chunks_failed": failed_chunks
+    })
 
-    all_entities = []
+    return {"status": "success", "graph_id": graph_id}
 
-    for idx, chunk in enumerate(chunks):
+def iter_extracted(chunks, is_tatar: bool, concurrency: int = GIGACHAT_CONCURRENCY):
+    """
+    Результаты извлечения в порядке чанков: (сущности, не удалось ли извлечь чанк).
+    В полёте не больше concurrency запросов к GigaChat, а следующий чанк отправляется
+    только после того, как забран самый старый результат
+    """
+    concurrency = max(1, concurrency)
+    in_flight = deque()
+
+    def oldest_result():
+        idx, future = in_flight.popleft()
         try:
-            response = giga.extract_knowledge_graph(chunk, is_tatar)
-
-            raw = response.strip('`').replace('json\n', '', 1)
-            graph_list = json.loads(raw)
-            all_entities.extend(graph_list)
+            return list(future.result()), False
         except Exception as e:
             print(f"Ошибка при обработке чанка {idx+1}: {e}")
-        finally:
-            processed_chunks += 1
-            redis_status = json.dumps({
-                "status": "В процессе",
-                "graph_id": graph_id,
-                "chunks_total": total_chunks,
-                "chunks_done": processed_chunks
-            })
-            redis_client.set(f"graph_built:{self.request.id}", redis_status)
-            redis_client.publish(f"graph_built:{self.request.id}", redis_status)
-
-    for ent in all_entities:
+            return [], True
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for idx, chunk in enumerate(chunks):
+            in_flight.append((idx, pool.submit(extract_chunk, chunk, is_tatar)))
+            if len(in_flight) >= concurrency:
+                yield oldest_result()
+        while in_flight:
+            yield oldest_result()
+
+def ingest_pipelined(task_id: str, graph_id: int, is_tatar: bool, progress: dict, chunks=None, pages=None):
+    """
+    Потоковая загрузка: фоновый поток извлекает чанки и кладёт результаты в ограниченную очередь,
+    а задача векторизует и пишет их в Memgraph окнами по PIPELINE_WINDOW_CHUNKS чанков.
+    Если запись отстаёт, очередь заполняется и извлечение ждёт, поэтому память не растёт с размером документа.
+    Вместо чанков можно передать итератор страниц: их разбор и разбиение идут в том же фоновом потоке
+    """
+    progress = {
+        "status": "В процессе",
+        "graph_id": graph_id,
+        **progress,
+        "chunks_done": 0,
+        "chunks_failed": 0,
+        "chunks_written": 0,
+        "entities_written": 0
+    }
+    progress_lock = threading.Lock()
+
+    def report(**increments):
+        with progress_lock:
+            for key, value in increments.items():
+                progress[key] += value
+            publish_graph_status(task_id, progress)
+
+    extracted = queue.Queue(maxsize=max(1, PIPELINE_QUEUE_SIZE))
+    stop = threading.Event()
+    done = object()
+    errors = []
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                extracted.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def counted_pages():
+        for page in pages:
+            yield page
+            report(pages_done=1)
+
+    def produce():
         try:
-            # Проверка и нормализация типа
-            raw_type = ent.get("type", "Other")
-            if isinstance(raw_type, list):
-                clean_type = raw_type[0] if raw_type else "Other"
-            elif isinstance(raw_type, str):
-                clean_type = raw_type
+            if pages is not None:
+                chunks_source = iter_page_chunks(counted_pages())
             else:
-                clean_type = str(raw_type)
-            emb = get_embedding(ent["desc"] or ent["name"])
-            emb_b64 = encode_vector(emb)
-            mg.execute(
-                """
-                MERGE (e:Entity {name: $name, graph_id: $graph_id})
-                SET e.description = $desc,
-                e.embedding = $embedding,
-                e.type = $type
-                """,
-                {"name": ent["name"], "desc": ent["desc"], "type": clean_type, "graph_id": graph_id, "embedding": emb_b64}
-            )
+                chunks_source = chunks
+            for graph_list, failed in iter_extracted(chunks_source, is_tatar):
+                if not put(graph_list):
+                    return
+                report(chunks_done=1, chunks_failed=int(failed))
         except Exception as e:
-            print(f"Ошибка при создании узла: {e}")
+            errors.append(e)
+        finally:
+            put(done)
 
-    # Этот фрагмент перебирает все связи (relations) для каждой сущности (ent) и создаёт их в графе, при необходимости автоматически создавая недостающие узлы
-    # потому что GigaChat часто упоминает связи с сущностями, которые не описывает отдельно, и тогда узел b не создаётся на предыдущем этапе (узлы с описанием и эмбеддингами).
-    for ent in all_entities:
-        if "relations" in ent:
-            for rel in ent["relations"]:
-                try:
-                    mg.execute(
-                        f"""
-                        MERGE (a:Entity {{name: $from, graph_id: $graph_id}})
-                        ON CREATE SET a.description = '', a.embedding = ''
-                        MERGE (b:Entity {{name: $to, graph_id: $graph_id}})
-                        ON CREATE SET b.description = '', b.embedding = ''
-                        MERGE (a)-[r:`{rel['type']}` {{graph_id: $graph_id}}]->(b)
-                        """,
-                        {"from": ent["name"], "to": rel["target"], "graph_id": graph_id}
-                    )
-                except Exception as e:
-                    print(f"Ошибка при создании отношения {rel['type']}: {e}")
-
-    status_data = json.dumps({
-        "status": "SUCCESS",
+    producer = threading.Thread(target=produce, name=f"extract-{task_id}", daemon=True)
+    producer.start()
+
+    window, window_chunks = [], 0
+    try:
+        with graph_ingest(graph_id), memgraph_pool.connection() as conn:
+            while True:
+                item = extracted.get()
+                if item is not done:
+                    window.extend(item)
+                    window_chunks += 1
+                if window_chunks and (item is done or window_chunks >= PIPELINE_WINDOW_CHUNKS):
+                    names = write_entities(conn, graph_id, window)
+                    publish_graph_update(graph_id, names, final=False)
+                    report(chunks_written=window_chunks, entities_written=len(names))
+                    window, window_chunks = [], 0
+                if item is done:
+                    break
+    finally:
+        stop.set()
+        producer.join()
+    if errors:
+        raise errors[0]
+
+    with progress_lock:
+        progress["status"] = "SUCCESS"
+        # Для документа по страницам число чанков известно только в конце
+        if progress["chunks_total"] is None:
+            progress["chunks_total"] = progress["chunks_done"]
+        publish_graph_status(task_id, progress)
+    return {"status": "success", "graph_id": graph_id}
+
+@celery_app.task(bind=True, name=PROCESS_DOCUMENT_TASK, acks_late=True)
+def process_document_task(self, source: str, kind: str, graph_id: int, user_id: int):
+    """
+    Загрузка документа из UPLOAD_DIR или по ссылке. Страницы разбираются по мере
+    извлечения сущностей (всегда потоково, независимо от INGEST_MODE). Файл удаляется
+    после загрузки; если воркер упал, он остаётся для повторной доставки задачи
+    """
+    db: Session = next(database.get_db())
+    graph = get_graph_by_id(db, graph_id)
+    is_tatar = graph.is_tatar if graph else False
+    db.close()
+
+    try:
+        with open_pages(source, kind) as (pages_total, pages):
+            result = ingest_pipelined(self.request.id, graph_id, is_tatar,
+                                      {"pages_total": pages_total, "pages_done": 0, "chunks_total": None},
+                                      pages=pages)
+    except Exception as e:
+        publish_graph_failure(self.request.id, graph_id, e)
+        raise
+    finally:
+        if kind != KIND_URL:
+            remove_upload(source)
+    return result
+
+def dispatch_distributed_ingest(task_id: str, chunks: list, graph_id: int, is_tatar: bool):
+    """
+    Раскидывает извлечение по воркерам: группа подзадач по CHUNKS_PER_SUBTASK чанков,
+    а финальная задача chord векторизует сущности и пишет их в Memgraph.
+    Прогресс всех подзадач собирается в канал graph_built:{task_id} исходной задачи
+    """
+    total_chunks = len(chunks)
+    get_redis_client().set(f"graph_progress:{task_id}", 0, ex=PROGRESS_TTL_SECONDS)
+    get_redis_client().set(f"graph_failed:{task_id}", 0, ex=PROGRESS_TTL_SECONDS)
+    publish_graph_status(task_id, {
+        "status": "В процессе",
         "graph_id": graph_id,
         "chunks_total": total_chunks,
-        "chunks_done": processed_chunks
+        "chunks_done": 0,
+        "chunks_failed": 0
     })
-    redis_client.set(f"graph_built:{self.request.id}", status_data)
-    redis_client.publish(f"graph_built:{self.request.id}", status_data)
 
+    header = [
+        extract_chunks_task.s(chunks[start:start + CHUNKS_PER_SUBTASK], is_tatar, task_id, graph_id, total_chunks)
+        for start in range(0, total_chunks, CHUNKS_PER_SUBTASK)
+    ]
+    callback = finalize_graph_task.s(graph_id, task_id, total_chunks).on_error(
+        ingest_failed_task.s(task_id, graph_id)
+    )
+    result = chord(header)(callback)
+    return {"status": "dispatched", "graph_id": graph_id, "chord_id": result.id}
+
+@celery_app.task(acks_late=True)
+def extract_chunks_task(chunks: list, is_tatar: bool, task_id: str, graph_id: int, total_chunks: int):
+    """
+    Подзадача распределённой загрузки: извлечение сущностей из части чанков документа
+    """
+    def on_chunk_done(failed: bool):
+        pipe = get_redis_client().pipeline()
+        pipe.incr(f"graph_progress:{task_id}")
+        pipe.incrby(f"graph_failed:{task_id}", int(failed))
+        done, failed_total = pipe.execute()
+        publish_graph_status(task_id, {
+            "status": "В процессе",
+            "graph_id": graph_id,
+            "chunks_total": total_chunks,
+            "chunks_done": done,
+            "chunks_failed": failed_total
+        })
+
+    return extract_chunks(chunks, is_tatar, on_chunk_done)
+
+@celery_app.task(acks_late=True)
+def finalize_graph_task(parts: list, graph_id: int, task_id: str, total_chunks: int):
+    """
+    Финал chord: результаты подзадач приходят в порядке чанков, склеиваем и пишем граф
+    """
+    all_entities = []
+    for part in parts:
+        all_entities.extend(part)
+    build_graph(graph_id, all_entities)
+
+    failed_chunks = int(get_redis_client().get(f"graph_failed:{task_id}") or 0)
+    get_redis_client().delete(f"graph_progress:{task_id}", f"graph_failed:{task_id}")
+    publish_graph_status(task_id, {
+        "status": "SUCCESS",
+        "graph_id": graph_id,
+        "chunks_total": total_chunks,
+        "chunks_done": total_chunks,
+        "chunks_failed": failed_chunks
+    })
     return {"status": "success", "graph_id": graph_id}
 
+@celery_app.task
+def ingest_failed_task(request, exc, traceback, task_id: str, graph_id: int):
+    get_redis_client().delete(f"graph_progress:{task_id}", f"graph_failed:{task_id}")
+    publish_graph_failure(task_id, graph_id, exc)
 
-@celery_app.task(bind=True)
+
+@celery_app.task(bind=True, name=SEARCH_GRAPH_TASK)
 def search_graph_task(self, query: str, graph_id: int, user_id: int):
     db: Session = next(database.get_db())
     graph = get_graph_by_id(db, graph_id)
@@ -144,117 +594,62 @@ def search_graph_task(self, query: str, graph_id: int, user_id: int):
 
     try:
         # Вектор запроса
-        query_vec = embedding_model.encode(query, normalize_embeddings=True)
-
-        # Получаем весь граф из Memgraph
-        conn = get_memgraph_connection()
-        cursor = conn.cursor()
-
-        # Извлечение всех узлов графа с эмбендингами
-        cursor.execute(
-            "MATCH (e:Entity {graph_id: $graph_id}) RETURN e.name, e.description, e.embedding",
-            {"graph_id": graph_id}
-        )
-
-        all_nodes = []
-        # Кандидаты на отправку в LLM
-        candidates = []
-        for name, desc, emb_b64 in cursor.fetchall():
-            if emb_b64:
-                node_vec = np.frombuffer(base64.b64decode(emb_b64), dtype=np.float32)
-                sim = np.dot(query_vec, node_vec)
-                all_nodes.append((name, desc, sim))
-                candidates.append((sim, name))
-        # Топ-K узлов по семантической близости
-        top_names = [name for _, name in sorted(candidates, reverse=True)[:10]]
-
-    # Semantic Expansion: соседние узлы (до 2-х хопов)
-        cursor.execute(
-            """
+        query_vec = get_embeddings([query])[0]
+
+        # Тот же или почти тот же вопрос к неизменённому графу — отвечаем из кэша
+        graph_version = get_graph_version(get_redis_client(), graph_id)
+        cached_answer = answer_cache.lookup(graph_id, graph_version, query_vec)
+        if cached_answer is not None:
+            return publish_answer(task_id, query, cached_answer, graph_id, user_id)
+
+        with memgraph_pool.connection() as conn:
+            cursor = conn.cursor()
+
+            # Эмбеддинги всех узлов графа лежат в векторном индексе воркера
+            index = index_cache.get(graph_id, conn, get_redis_client())
+
+            # Ближайшие узлы по (возможно квантованным) эмбеддингам
+            rerank = index.dtype != "float32" and EMBEDDING_RERANK_TOP > 0
+            nearest_idx, _ = index.top_k(query_vec, max(20, EMBEDDING_RERANK_TOP) if rerank else 20)
+            rerank_sims = {}
+            if rerank:
+                rerank_sims = rerank_similarities(cursor, graph_id, [index.names[i] for i in nearest_idx], query_vec)
+                approx_sims = index.similarities(query_vec, nearest_idx)
+                reranked = np.array([rerank_sims.get(index.names[i], sim) for i, sim in zip(nearest_idx, approx_sims)])
+                nearest_idx = nearest_idx[np.argsort(-reranked)]
+
+            # Расширение окрестности топ-10 и ранжирование кандидатов по матрице смежности в памяти воркера
+            adjacency = adjacency_cache.get(graph_id, conn, get_redis_client())
+            final_names = rank_nodes(index, adjacency, query_vec, nearest_idx, rerank_sims)
+
+            print('Узлы отправленные в gigachat', final_names)
+            cursor.execute(
+                """
                 UNWIND $names AS name
-                MATCH (a:Entity {graph_id: $graph_id}) 
-                WHERE a.name = name
-                MATCH (a)-[*1..2]-(b:Entity {graph_id: $graph_id})
-                RETURN DISTINCT a.name, a.description, b.name, b.description
-            """,
-            {"graph_id": graph_id, "names": top_names}
-        )
-
-        node_set = set()
-        edge_set = set()
-
-        for a_name, a_desc, b_name, b_desc in cursor.fetchall():
-            if isinstance(a_name, str) and isinstance(a_desc, str):
-                node_set.add((a_name, a_desc))
-            else:
-                print("Пропущено: неверный тип данных", a_name, a_desc)
-            if isinstance(b_name, str) and isinstance(b_desc, str):
-                node_set.add((b_name, b_desc))
-            else:
-                print("Пропущено: неверный тип данных", b_name, b_desc)
-            if isinstance(a_name, str) and isinstance(b_name, str):
-                edge_set.add((a_name, b_name))
-            else:
-                print("Пропущено: неверный тип данных", a_name, b_name)    
-
-        # PageRank (на клиенте, в NetworkX)
-        G = nx.Graph()
-        for name, desc in node_set:
-            G.add_node(name, description=desc)
-        for source, target in edge_set:
-            G.add_edge(source, target)
-
-        pagerank_scores = nx.pagerank(G)
-
-        # Сортировка узлов по: alpha*similarity + beta*pagerank
-        alpha, beta = 0.7, 0.3
-        scored_nodes = []
-        for name, desc, sim in all_nodes:
-            pr = pagerank_scores.get(name, 0.0)
-            score = alpha * sim + beta * pr
-            scored_nodes.append((score, name))
-
-        top_nodes = sorted(scored_nodes, reverse=True)[:20]
-        final_names = [name for _, name in top_nodes]
-
-        print('Узлы отправленные в gigachat', final_names)
-        cursor.execute(
-            """
-            UNWIND $names AS name
-            MATCH (a:Entity {name: name, graph_id: $graph_id})-[r]-(b:Entity {graph_id: $graph_id})
-            RETURN a.name, a.description, type(r), b.name, b.description
-            """,
-            {"graph_id": graph_id, "names": final_names}
-        )
-
-        triples = []
-        for a_name, a_desc, rel_type, b_name, b_desc in cursor.fetchall():
-            triples.append({
-                "source": a_name,
-                "source_desc": a_desc,
-                "relation": rel_type,
-                "target": b_name,
-                "target_desc": b_desc
-            })
-        print('Данные из графа, отправленные в gigachat', triples)
-        cursor.close()
-        conn.close()
-
-        import json
+                MATCH (a:Entity {name: name, graph_id: $graph_id})-[r]-(b:Entity {graph_id: $graph_id})
+                RETURN a.name, a.description, type(r), b.name, b.description
+                """,
+                {"graph_id": graph_id, "names": final_names}
+            )
+
+            triples = []
+            for a_name, a_desc, rel_type, b_name, b_desc in cursor.fetchall():
+                triples.append({
+                    "source": a_name,
+                    "source_desc": a_desc,
+                    "relation": rel_type,
+                    "target": b_name,
+                    "target_desc": b_desc
+                })
+            print('Данные из графа, отправленные в gigachat', triples)
+            cursor.close()
+
         graph_data = json.dumps(triples)
         answer = giga.answer_semantic_query(query, graph_data, is_tatar)
 
-        # Сохраняем ответ в историю
-        db: Session = next(database.get_db())
-        crud.save_query_result(db, query, answer, graph_id, user_id)
-        print('ответ от гигачата в celery', answer)
-        result = {"status": "SUCCESS", "answer": answer}
-        redis_client.publish(f"answer:{task_id}", json.dumps(result))
-        redis_client.set(f"answer:{task_id}", json.dumps(result))
-
-        return result
+        answer_cache.store(graph_id, graph_version, query, query_vec, answer)
+        return publish_answer(task_id, query, answer, graph_id, user_id)
     
     except Exception as e:
-        redis_client.publish(f"answer:{task_id}", json.dumps({"status": "FAILURE", "error": str(e)}))
-        redis_client.set(f"answer:{task_id}", json.dumps({"status": "FAILURE", "error": str(e)}))
+        publish_progress(get_redis_client(), f"answer:{task_id}", {"status": "FAILURE", "error": str(e)})
         raise
\ No newline at end of file
@@ -0,0 +1,103 @@
+# backend/user_cache.py
+"""
+Кэш пользователей для get_current_user: проверка токена не ходит в Postgres на каждый запрос.
+
+Хранится в Redis, чтобы удаление пользователя или смена пароля в одном процессе gunicorn
+сразу сбрасывали запись во всех. Записи живут USER_CACHE_TTL_SECONDS.
+
+Сброс увеличивает версию пользователя, а промах запоминает версию до чтения из Postgres:
+запись кладётся в кэш, только если версия не изменилась. Иначе запрос, прочитавший
+пользователя до удаления или смены прав, вернул бы в кэш устаревшую запись.
+"""
+import os
+import json
+
+import redis
+
+USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "1") == "1"
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+# Версия должна жить заметно дольше записи и любого чтения из Postgres
+USER_VERSION_TTL_SECONDS = int(os.getenv("USER_VERSION_TTL_SECONDS", "86400"))
+
+KEY_PREFIX = "user:"
+VERSION_KEY_PREFIX = "user_version:"
+HITS_KEY = "user_cache:hits"
+MISSES_KEY = "user_cache:misses"
+
+
+def user_cache_key(username: str) -> str:
+    return KEY_PREFIX + username
+
+
+def user_version_key(username: str) -> str:
+    return VERSION_KEY_PREFIX + username
+
+
+# SET только если версия пользователя та же, что была до чтения из Postgres
+PUT_IF_VERSION_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] then
+    return redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+end
+return false
+"""
+
+
+def user_fields(user) -> dict:
+    return {"id": user.id, "username": user.username, "is_admin": user.is_admin}
+
+
+class UserCache:
+    def __init__(self, get_client, get_async_client=None, ttl: int = USER_CACHE_TTL_SECONDS,
+                 enabled: bool = USER_CACHE_ENABLED):
+        # Асинхронный клиент читает и пишет записи в get_current_user, синхронный сбрасывает их из обычных эндпоинтов
+        self.get_client = get_client
+        self.get_async_client = get_async_client
+        self.ttl = ttl
+        self.enabled = enabled
+
+    async def get_async(self, username: str) -> tuple:
+        """
+        (поля пользователя (id, username, is_admin) или None, версия для put_async).
+        Ошибка Redis — тоже промах, а не отказ в доступе
+        """
+        if not self.enabled:
+            return None, None
+        try:
+            client = self.get_async_client()
+            value, version = await client.mget(user_cache_key(username), user_version_key(username))
+            await client.incr(MISSES_KEY if value is None else HITS_KEY)
+        except redis.RedisError as e:
+            print(f"Ошибка кэша пользователей: {e}")
+            return None, None
+        return (json.loads(value) if value is not None else None), str(int(version or 0))
+
+    async def put_async(self, user, version: str):
+        """
+        Кладёт пользователя в кэш, если с get_async его не сбрасывали
+        """
+        if not self.enabled or version is None:
+            return
+        try:
+            await self.get_async_client().eval(
+                PUT_IF_VERSION_SCRIPT, 2, user_cache_key(user.username), user_version_key(user.username),
+                version, json.dumps(user_fields(user)), self.ttl
+            )
+        except redis.RedisError as e:
+            print(f"Ошибка кэша пользователей: {e}")
+
+    def invalidate(self, username: str):
+        try:
+            pipe = self.get_client().pipeline()
+            pipe.incr(user_version_key(username))
+            pipe.expire(user_version_key(username), USER_VERSION_TTL_SECONDS)
+            pipe.delete(user_cache_key(username))
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"Ошибка кэша пользователей: {e}")
+
+    def stats(self) -> dict:
+        client = self.get_client()
+        hits, misses = client.mget(HITS_KEY, MISSES_KEY)
+        hits, misses = int(hits or 0), int(misses or 0)
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
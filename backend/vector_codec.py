@@ -0,0 +1,81 @@
+# backend/vector_codec.py
+import os
+import base64
+
+import numpy as np
+
+# Формат хранения эмбеддингов в Memgraph и размер 384-мерного вектора на узел
+# (память свойства в Memgraph / передача по Bolt):
+#   base64  — старая строка float32: ~2 КБ / ~2 КБ, только читается;
+#   float32 — список double: байт типа + 8 байт на элемент, ~3,4 КБ / ~3,4 КБ — больше строки;
+#   float16 — список целых с битами half-float: ~1,2 КБ / ~1,2 КБ;
+#   int8    — список целых [-127, 127] и масштаб на вектор: ~0,8 КБ / ~0,6 КБ (по умолчанию).
+# Целые в свойствах и в Bolt кодируются минимальным числом байт, double — всегда восемью
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "int8")
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+
+def quantize(vector, dtype: str = EMBEDDING_STORAGE):
+    """
+    float32-вектор в формат хранения: (значения numpy, масштаб или None)
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    if dtype == "float32":
+        return vector, None
+    if dtype == "float16":
+        return vector.astype(np.float16), None
+    if dtype == "int8":
+        scale = float(np.abs(vector).max()) / 127.0
+        if scale == 0.0:
+            return np.zeros(vector.shape, dtype=np.int8), 1.0
+        return np.clip(np.rint(vector / scale), -127, 127).astype(np.int8), scale
+    raise ValueError(f"неизвестный формат эмбеддингов: {dtype}")
+
+
+def quantize_rows(matrix, dtype: str = EMBEDDING_STORAGE):
+    """
+    Построчное квантование матрицы: (значения, масштабы строк или None)
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0.0] = 1.0
+        values = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return values, scales.astype(np.float32)
+    return quantize(matrix, dtype)
+
+
+def dequantize(values, dtype: str = "float32", scale: float = None) -> np.ndarray:
+    if dtype == "int8":
+        return np.asarray(values, dtype=np.float32) * np.float32(scale)
+    return np.asarray(values, dtype=np.float32)
+
+
+def encode_embedding(vector, dtype: str = EMBEDDING_STORAGE) -> dict:
+    """
+    Свойства узла для эмбеддинга в заданном формате: embedding, embedding_dtype, embedding_scale
+    """
+    values, scale = quantize(vector, dtype)
+    if dtype == "float16":
+        # Биты half-float как int16: Memgraph не умеет хранить float16 напрямую
+        embedding = values.view(np.int16).tolist()
+    else:
+        embedding = values.tolist()
+    return {"embedding": embedding, "embedding_dtype": dtype, "embedding_scale": scale}
+
+
+def decode_vector(value, dtype: str = None, scale: float = None):
+    """
+    Эмбеддинг узла из Memgraph в float32.
+    Понимает старую base64-строку и списки во всех форматах хранения.
+    Пустые значения (узлы, созданные по связям) — None
+    """
+    if value is None or len(value) == 0:
+        return None
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype=np.float32)
+    if dtype == "float16":
+        return np.asarray(value, dtype=np.int16).view(np.float16).astype(np.float32)
+    if dtype == "int8":
+        return dequantize(value, "int8", scale)
+    return np.asarray(value, dtype=np.float32)
@@ -0,0 +1,250 @@
+# backend/vector_index.py
+import os
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from backend.embeddings import EMBEDDING_DIM
+from backend.vector_codec import EMBEDDING_STORAGE, decode_vector, dequantize, quantize_rows
+
+# Общий бюджет памяти на матрицы эмбеддингов всех графов в одном процессе воркера
+VECTOR_INDEX_MAX_BYTES = int(os.getenv("VECTOR_INDEX_MAX_BYTES", str(512 * 1024 * 1024)))
+# Формат матрицы в памяти воркера; по умолчанию совпадает с форматом хранения в Memgraph
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", EMBEDDING_STORAGE)
+# Сколько строк квантованной матрицы переводится во float32 за раз при подсчёте близости
+SIMILARITY_BLOCK_ROWS = int(os.getenv("SIMILARITY_BLOCK_ROWS", "16384"))
+# Сколько версий графа можно догнать по дельтам, прежде чем перечитать граф целиком
+VECTOR_INDEX_MAX_DELTA_STEPS = int(os.getenv("VECTOR_INDEX_MAX_DELTA_STEPS", "50"))
+GRAPH_DELTA_TTL_SECONDS = int(os.getenv("GRAPH_DELTA_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+
+ALL_VECTORS_QUERY = """
+MATCH (e:Entity {graph_id: $graph_id})
+RETURN e.name, e.embedding, e.embedding_dtype, e.embedding_scale
+"""
+
+DELTA_VECTORS_QUERY = """
+UNWIND $names AS name
+MATCH (e:Entity {graph_id: $graph_id})
+WHERE e.name = name
+RETURN e.name, e.embedding, e.embedding_dtype, e.embedding_scale
+"""
+
+
+def graph_version_key(graph_id: int) -> str:
+    return f"graph_version:{graph_id}"
+
+
+def graph_delta_key(graph_id: int, version: int) -> str:
+    return f"graph_delta:{graph_id}:{version}"
+
+
+def mark_graph_updated(redis_client, graph_id: int, names) -> int:
+    """
+    Вызывается после записи узлов: поднимает версию графа и запоминает имена изменённых узлов,
+    чтобы индексы в воркерах дочитали только их
+    """
+    version = redis_client.incr(graph_version_key(graph_id))
+    names = sorted({name for name in names if isinstance(name, str)})
+    redis_client.set(graph_delta_key(graph_id, version), json.dumps(names), ex=GRAPH_DELTA_TTL_SECONDS)
+    return version
+
+
+def get_graph_version(redis_client, graph_id: int) -> int:
+    value = redis_client.get(graph_version_key(graph_id))
+    return int(value) if value else 0
+
+
+class GraphVectors:
+    """
+    Эмбеддинги одного графа: непрерывная матрица в формате VECTOR_INDEX_DTYPE
+    (float32, float16 или int8 с масштабом на строку). Поиск точный: одно умножение
+    матрицы на вектор запроса блоками по SIMILARITY_BLOCK_ROWS строк
+    """
+
+    def __init__(self, graph_id: int, version: int, dim: int = EMBEDDING_DIM, dtype: str = VECTOR_INDEX_DTYPE):
+        self.graph_id = graph_id
+        self.version = version
+        self.dtype = dtype
+        self.names = []
+        self.name_to_idx = {}
+        self._data = np.zeros((0, dim), dtype=np.dtype(dtype))
+        self._scales = np.ones(0, dtype=np.float32)
+        self.size = 0
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._data[:self.size]
+
+    @property
+    def scales(self) -> np.ndarray:
+        return self._scales[:self.size]
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes + self._scales.nbytes
+
+    def vectors(self, idx: np.ndarray = None) -> np.ndarray:
+        """
+        Деквантованные float32-вектора строк
+        """
+        rows = self.matrix if idx is None else self.matrix[idx]
+        if self.dtype == "int8":
+            scales = self.scales if idx is None else self.scales[idx]
+            return dequantize(rows, "int8", scales[:, None])
+        return rows.astype(np.float32)
+
+    def _store(self, idx, block: np.ndarray):
+        values, scales = quantize_rows(block, self.dtype)
+        self._data[idx] = values
+        if scales is not None:
+            self._scales[idx] = scales
+
+    def upsert(self, names: list, vectors: list):
+        new_positions, new_rows = {}, []
+        updated_idx, updated_rows = [], []
+        for name, vec in zip(names, vectors):
+            idx = self.name_to_idx.get(name)
+            if idx is None:
+                if name in new_positions:
+                    new_rows[new_positions[name]] = vec
+                    continue
+                new_positions[name] = len(new_rows)
+                new_rows.append(vec)
+            else:
+                updated_idx.append(idx)
+                updated_rows.append(vec)
+        if updated_idx:
+            updated_idx = np.array(updated_idx, dtype=np.int64)
+            block = np.asarray(updated_rows, dtype=np.float32)
+            self._store(updated_idx, block)
+        if not new_rows:
+            return
+        new_size = self.size + len(new_rows)
+        if new_size > len(self._data):
+            # Ёмкость растёт вдвое, чтобы дозагрузка дельт не копировала матрицу каждый раз
+            capacity = max(new_size, 2 * len(self._data), 1024)
+            data = np.zeros((capacity, self._data.shape[1]), dtype=self._data.dtype)
+            data[:self.size] = self.matrix
+            self._data = data
+            scales = np.ones(capacity, dtype=np.float32)
+            scales[:self.size] = self.scales
+            self._scales = scales
+        block = np.asarray(new_rows, dtype=np.float32)
+        self._store(slice(self.size, new_size), block)
+        for name, offset in new_positions.items():
+            self.name_to_idx[name] = self.size + offset
+        self.names.extend(new_positions)
+        self.size = new_size
+
+    def similarities(self, query_vec: np.ndarray, idx: np.ndarray = None) -> np.ndarray:
+        """
+        Косинусная близость запроса к узлам (вектора нормализованы, так что это скалярное произведение).
+        Квантованная матрица переводится во float32 блоками, чтобы не держать её полную копию
+        """
+        query_vec = np.asarray(query_vec, dtype=np.float32)
+        rows = self.matrix if idx is None else self.matrix[idx]
+        if self.dtype == "float32":
+            return rows @ query_vec
+        sims = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SIMILARITY_BLOCK_ROWS):
+            sims[start:start + SIMILARITY_BLOCK_ROWS] = rows[start:start + SIMILARITY_BLOCK_ROWS].astype(np.float32) @ query_vec
+        if self.dtype == "int8":
+            sims *= self.scales if idx is None else self.scales[idx]
+        return sims
+
+    def top_k(self, query_vec: np.ndarray, k: int):
+        """
+        Индексы и близости k ближайших узлов, по убыванию близости
+        """
+        k = min(k, self.size)
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        sims = self.similarities(query_vec)
+        idx = np.argpartition(-sims, k - 1)[:k]
+        idx = idx[np.argsort(-sims[idx])]
+        return idx, sims[idx]
+
+
+def load_vectors(conn, graph_id: int, names: list = None):
+    cursor = conn.cursor()
+    try:
+        if names is None:
+            cursor.execute(ALL_VECTORS_QUERY, {"graph_id": graph_id})
+        else:
+            cursor.execute(DELTA_VECTORS_QUERY, {"graph_id": graph_id, "names": names})
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    loaded_names, vectors = [], []
+    for name, value, dtype, scale in rows:
+        vec = decode_vector(value, dtype, scale)
+        if vec is not None:
+            loaded_names.append(name)
+            vectors.append(vec)
+    return loaded_names, vectors
+
+
+class VectorIndexCache:
+    """
+    LRU-кэш GraphVectors по graph_id с общим ограничением памяти.
+    Граф читается из Memgraph при первом запросе, а после загрузок текста дочитываются
+    только изменённые узлы по дельтам из Redis
+    """
+
+    def __init__(self, max_bytes: int = VECTOR_INDEX_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.graphs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, graph_id: int, conn, redis_client) -> GraphVectors:
+        with self.lock:
+            version = get_graph_version(redis_client, graph_id)
+            index = self.graphs.get(graph_id)
+            if index is None or index.version > version:
+                index = self._load_full(graph_id, version, conn)
+            elif index.version < version:
+                if not self._apply_deltas(index, version, conn, redis_client):
+                    index = self._load_full(graph_id, version, conn)
+            self.graphs[graph_id] = index
+            self.graphs.move_to_end(graph_id)
+            self._evict(keep=graph_id)
+            return index
+
+    def invalidate(self, graph_id: int):
+        with self.lock:
+            self.graphs.pop(graph_id, None)
+
+    def _load_full(self, graph_id: int, version: int, conn) -> GraphVectors:
+        index = GraphVectors(graph_id, version)
+        names, vectors = load_vectors(conn, graph_id)
+        index.upsert(names, vectors)
+        return index
+
+    def _apply_deltas(self, index: GraphVectors, version: int, conn, redis_client) -> bool:
+        if version - index.version > VECTOR_INDEX_MAX_DELTA_STEPS:
+            return False
+        changed = set()
+        for step in range(index.version + 1, version + 1):
+            delta = redis_client.get(graph_delta_key(index.graph_id, step))
+            if delta is None:
+                return False
+            changed.update(json.loads(delta))
+        if changed:
+            names, vectors = load_vectors(conn, index.graph_id, sorted(changed))
+            index.upsert(names, vectors)
+        index.version = version
+        return True
+
+    def _evict(self, keep: int):
+        total = sum(index.nbytes for index in self.graphs.values())
+        while total > self.max_bytes and len(self.graphs) > 1:
+            graph_id, index = next(iter(self.graphs.items()))
+            if graph_id == keep:
+                break
+            self.graphs.popitem(last=False)
+            total -= index.nbytes
+
+
+index_cache = VectorIndexCache()
@@ -0,0 +1,84 @@
+# benchmarks/api_benchmark.py
+"""
+Пропускная способность горячих эндпоинтов API (/graphs/ и /history/).
+
+Логинится тестовым пользователем и --duration секунд держит --concurrency параллельных
+клиентов на каждом эндпоинте, затем печатает запросы в секунду, задержки и ошибки.
+Чтобы сравнить до и после перехода на асинхронный слой БД, запустите скрипт
+против сборки предыдущего коммита и текущей с одинаковыми параметрами.
+
+    python benchmarks/api_benchmark.py --url http://localhost:8000 --username bench --password bench --concurrency 64
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ENDPOINTS = ["/graphs/", "/history/"]
+
+
+def login(url: str, username: str, password: str) -> str:
+    credentials = {"username": username, "password": password}
+    r = requests.post(f"{url}/login", json=credentials)
+    if r.status_code != 200:
+        requests.post(f"{url}/register", json=credentials).raise_for_status()
+        r = requests.post(f"{url}/login", json=credentials)
+    r.raise_for_status()
+    return r.json()["access_token"]
+
+
+def hammer(url: str, token: str, deadline: float, latencies: list, errors: list, lock: threading.Lock):
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {token}"
+    local_latencies, local_errors = [], 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            r = session.get(url, timeout=30)
+            if r.status_code != 200:
+                local_errors += 1
+        except requests.RequestException:
+            local_errors += 1
+        local_latencies.append(time.perf_counter() - started)
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+def run(url: str, token: str, endpoint: str, concurrency: int, duration: float):
+    latencies, errors, lock = [], [], threading.Lock()
+    deadline = time.perf_counter() + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(hammer, f"{url}{endpoint}", token, deadline, latencies, errors, lock)
+    print(
+        f"{endpoint:<10} {len(latencies) / duration:8.1f} запросов/с, "
+        f"p50 {percentile(latencies, 0.5) * 1000:.1f} мс, p95 {percentile(latencies, 0.95) * 1000:.1f} мс, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.1f} мс, ошибок {sum(errors)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк горячих эндпоинтов API")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--username", default="bench")
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20.0)
+    args = parser.parse_args()
+
+    token = login(args.url, args.username, args.password)
+    print(f"{args.concurrency} параллельных клиентов, {args.duration:.0f} с на эндпоинт")
+    for endpoint in ENDPOINTS:
+        run(args.url, token, endpoint, args.concurrency, args.duration)
+
+
+if __name__ == "__main__":
+    main()
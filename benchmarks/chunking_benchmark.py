@@ -0,0 +1,82 @@
+# benchmarks/chunking_benchmark.py
+"""
+Сравнение символьного и токенного разбиения на чанки на примерах документов.
+
+Для каждого документа и способа разбиения печатает число чанков, объём повторно
+отправляемого текста (перекрытие), оценку токенов и время разбиения.
+С --extract каждый чанк отправляется в GigaChat (без кэша извлечения)
+и замеряется суммарное время извлечения и число сущностей.
+
+    PYTHONPATH=. python benchmarks/chunking_benchmark.py docs/*.txt [--budget 1024] [--extract --max-chunks 20]
+"""
+import argparse
+import json
+import time
+
+from backend.chunking import (
+    CHUNK_OVERLAP_SENTENCES,
+    CHUNK_TOKEN_BUDGET,
+    HeuristicTokenCounter,
+    iter_text_by_overlap,
+    iter_token_chunks,
+)
+
+
+def extract(chunks: list) -> tuple:
+    from backend import giga
+
+    started = time.perf_counter()
+    entities = 0
+    for chunk in chunks:
+        response = giga.extract_knowledge_graph(chunk)
+        try:
+            entities += len(json.loads(response.strip('`').replace('json\n', '', 1)))
+        except Exception as e:
+            print(f"  не удалось разобрать ответ: {e}")
+    return time.perf_counter() - started, entities
+
+
+def run(path: str, budget: int, overlap_sentences: int, do_extract: bool, max_chunks: int):
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    counter = HeuristicTokenCounter()
+    print(f"{path}: {len(text)} символов, ~{counter.count(text)} токенов")
+
+    chunkers = {
+        "chars": lambda: list(iter_text_by_overlap(text)),
+        "tokens": lambda: list(iter_token_chunks(text, budget, overlap_sentences, counter)),
+    }
+    for name, chunk in chunkers.items():
+        started = time.perf_counter()
+        chunks = chunk()
+        chunk_ms = (time.perf_counter() - started) * 1000
+        sent_chars = sum(len(c) for c in chunks)
+        repeated = (sent_chars / len(text) - 1) * 100 if text else 0.0
+        print(
+            f"  {name:<6} чанков {len(chunks):>5}, отправлено {sent_chars} символов (+{repeated:.1f}%), "
+            f"~{sum(counter.count_many(chunks))} токенов, разбиение {chunk_ms:.1f} мс"
+        )
+        if do_extract:
+            sample = chunks[:max_chunks] if max_chunks else chunks
+            seconds, entities = extract(sample)
+            print(
+                f"  {name:<6} извлечение {len(sample)} чанков: {seconds:.1f} с "
+                f"({seconds / max(len(sample), 1):.1f} с на чанк), сущностей {entities}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбиения документов на чанки")
+    parser.add_argument("paths", nargs="+", help="текстовые файлы с примерами документов")
+    parser.add_argument("--budget", type=int, default=CHUNK_TOKEN_BUDGET)
+    parser.add_argument("--overlap-sentences", type=int, default=CHUNK_OVERLAP_SENTENCES)
+    parser.add_argument("--extract", action="store_true", help="замерить извлечение через GigaChat")
+    parser.add_argument("--max-chunks", type=int, default=0, help="извлекать не больше N чанков на способ")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        run(path, args.budget, args.overlap_sentences, args.extract, args.max_chunks)
+
+
+if __name__ == "__main__":
+    main()
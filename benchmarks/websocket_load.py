@@ -0,0 +1,101 @@
+# benchmarks/websocket_load.py
+"""
+Нагрузочный тест WebSocket-уведомлений о загрузке графа.
+
+Открывает --sockets соединений с /ws/graph/{task_id}, публикует в Redis по --messages
+сообщений прогресса в каждый канал и финальный SUCCESS, а затем печатает число
+клиентских соединений Redis до и во время теста и задержку доставки сообщений.
+Для тысяч сокетов может понадобиться поднять лимит файлов: ulimit -n 65536.
+
+    python benchmarks/websocket_load.py --url ws://localhost:8000 --redis-host localhost --sockets 2000
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import redis.asyncio as redis
+import websockets
+
+
+async def redis_connections(client) -> dict:
+    info = await client.info("clients")
+    return {
+        "connected_clients": info.get("connected_clients"),
+        "pubsub_patterns": await client.pubsub_numpat(),
+    }
+
+
+async def listen(url: str, ready: asyncio.Event, opened: list, latencies: list):
+    async with websockets.connect(url, open_timeout=60) as websocket:
+        opened.append(1)
+        await ready.wait()
+        while True:
+            data = json.loads(await websocket.recv())
+            if "sent_at" in data:
+                latencies.append(time.time() - data["sent_at"])
+            if data.get("status") in ("SUCCESS", "FAILURE"):
+                return
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест WebSocket + Redis pub/sub")
+    parser.add_argument("--url", default="ws://localhost:8000")
+    parser.add_argument("--redis-host", default="localhost")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--sockets", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=0.5, help="пауза между волнами сообщений, с")
+    args = parser.parse_args()
+
+    client = redis.Redis(host=args.redis_host, port=args.redis_port, db=0)
+    before = await redis_connections(client)
+
+    run_id = uuid.uuid4().hex[:8]
+    task_ids = [f"bench-{run_id}-{i}" for i in range(args.sockets)]
+    ready = asyncio.Event()
+    opened, latencies = [], []
+    started = time.perf_counter()
+    listeners = [
+        asyncio.create_task(listen(f"{args.url}/ws/graph/{task_id}", ready, opened, latencies))
+        for task_id in task_ids
+    ]
+    while len(opened) < args.sockets and not all(task.done() for task in listeners):
+        await asyncio.sleep(0.1)
+    print(f"Открыто сокетов: {len(opened)} за {time.perf_counter() - started:.1f} с")
+    # Даём обработчикам зарегистрироваться и прочитать снимок
+    await asyncio.sleep(1)
+    during = await redis_connections(client)
+    ready.set()
+
+    for wave in range(args.messages + 1):
+        status = "SUCCESS" if wave == args.messages else "В процессе"
+        pipe = client.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.publish(f"graph_built:{task_id}", json.dumps({"status": status, "chunks_done": wave, "sent_at": time.time()}))
+        await pipe.execute()
+        await asyncio.sleep(args.interval)
+
+    results = await asyncio.gather(*listeners, return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    expected = len(opened) * (args.messages + 1)
+    print(f"Соединения Redis до теста: {before}")
+    print(f"Соединения Redis при {len(opened)} сокетах: {during}")
+    print(f"Доставлено сообщений: {len(latencies)} из {expected}, ошибок сокетов: {len(errors)}")
+    print(
+        f"Задержка: p50 {percentile(latencies, 0.5) * 1000:.1f} мс, "
+        f"p95 {percentile(latencies, 0.95) * 1000:.1f} мс, p99 {percentile(latencies, 0.99) * 1000:.1f} мс"
+    )
+    await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -16,17 +16,12 @@ import time
 from pyvis.network import Network
 import streamlit.components.v1 as components
 import os
-import mgclient
 from datetime import datetime
 from streamlit_cookies_manager import EncryptedCookieManager
 from jose import JWTError, jwt
 import asyncio
 import websockets
 import json
-from bs4 import BeautifulSoup
-import fitz  # PyMuPDF
-import docx
-import re
 import random
 
 API_URL = os.getenv("API_URL", "http://localhost:8000")
@@ -119,16 +114,14 @@ def render_graph(graph_id: int, placeholder: st.delta_generator.DeltaGenerator):
     show_schema = st.checkbox("Посмотреть схему типов", value=False)
 
     with st.spinner("Рисуем граф..."):
-        conn = mgclient.connect(host="memgraph", port=7687)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            MATCH (a:Entity {graph_id: $graph_id})-[r]->(b:Entity {graph_id: $graph_id})
-            RETURN a.name, type(r), b.name
-            """,
-            {"graph_id": graph_id}
-        )
-        rows = cursor.fetchall()
+        # Данные графа отдаёт API из пула соединений с Memgraph
+        r = requests.get(f"{API_URL}/graphs/{graph_id}/data", headers=auth_headers())
+        if r.status_code != 200:
+            with placeholder:
+                st.error("Ошибка загрузки графа.")
+            return
+        graph_data = r.json()
+        rows = [tuple(edge) for edge in graph_data["edges"]]
         print('получено из memgraph', rows)
 
         if not rows:
@@ -137,14 +130,7 @@ def render_graph(graph_id: int, placeholder: st.delta_generator.DeltaGenerator):
             return
     
         # Получаем все узлы с типами
-        cursor.execute(
-            """
-            MATCH (n:Entity {graph_id: $graph_id})
-            RETURN n.name, n.type
-            """,
-            {"graph_id": graph_id}
-        )
-        nodes = cursor.fetchall()
+        nodes = [tuple(node) for node in graph_data["nodes"]]
         print('Получаем все узлы с типами', nodes)
 
         name_to_type = {}
@@ -221,15 +207,36 @@ async def wait_for_graph_and_render(task_id, graph_id):
                 status = data.get("status")
                 chunks_total = data.get("chunks_total")
                 chunks_done = data.get("chunks_done")
+                # Части, которые GigaChat не обработал даже после повторов
+                failed_note = f", Не удалось обработать частей: {data['chunks_failed']}" if data.get("chunks_failed") else ""
                 if status == "SUCCESS":
-                    placeholder.success("✅ Граф построен!")
+                    if data.get("chunks_failed"):
+                        placeholder.warning(
+                            f"⚠️ Граф построен без {data['chunks_failed']} из {chunks_total} частей текста: "
+                            f"GigaChat не обработал их после повторов."
+                        )
+                    else:
+                        placeholder.success("✅ Граф построен!")
                     render_graph(graph_id, graph_placeholder)
                     break
                 elif status == "FAILURE":
                     placeholder.error("❌ Ошибка при построении графа.")
                     break
+                elif "pages_total" in data:
+                    # Документ разбирается по страницам, число частей текста известно только в конце
+                    placeholder.info(
+                        f"⏳ Статус: {status}, Разобрано страниц: {data['pages_done']} из {data['pages_total']}, "
+                        f"Обработанных частей текста: {chunks_done}, "
+                        f"Записано в граф частей: {data['chunks_written']}, сущностей: {data['entities_written']}{failed_note}"
+                    )
+                elif "chunks_written" in data:
+                    # Потоковая загрузка: граф заполняется по мере записи частей
+                    placeholder.info(
+                        f"⏳ Статус: {status}, Всего частей текста: {chunks_total}, Обработанных частей текста: {chunks_done}, "
+                        f"Записано в граф частей: {data['chunks_written']}, сущностей: {data['entities_written']}{failed_note}"
+                    )
                 else:
-                    placeholder.info(f"⏳ Статус: {status}, Всего частей текста: {chunks_total}, Обработанных частей текста: {chunks_done}")
+                    placeholder.info(f"⏳ Статус: {status}, Всего частей текста: {chunks_total}, Обработанных частей текста: {chunks_done}{failed_note}")
     except Exception as e:
         placeholder.error(f"Ошибка WebSocket: {str(e)}")
 
@@ -254,29 +261,6 @@ async def wait_answer(task_id: str, graph_id: int):
         st.error(f"Ошибка WebSocket: {e}")
 
 
-def extract_text_from_pdf(file):
-    doc = fitz.open(stream=file.read(), filetype="pdf")
-    text = "\n".join([page.get_text() for page in doc])
-    return text
-
-def extract_text_from_docx(file):
-    doc = docx.Document(file)
-    text = "\n".join([para.text for para in doc.paragraphs])
-    return text
-
-def extract_text_from_url(url):
-    try:
-        r = requests.get(url)
-        soup = BeautifulSoup(r.text, 'html.parser')
-        # Убираем скрипты и стили
-        for s in soup(["script", "style"]):
-            s.decompose()
-        text = soup.get_text()
-        return re.sub(r'\s+', ' ', text.strip())
-    except Exception as e:
-        return f"Ошибка при загрузке страницы: {e}"
-
-
 if not st.session_state.token:
     login()
     st.stop()
@@ -288,6 +272,9 @@ nav_options = ["Поиск", "История"]
 if st.session_state.get("is_admin"):
     nav_options.append("Управление пользователями")
 page = st.sidebar.radio("Навигация", nav_options)
+# Переход на другую страницу: история при следующем открытии загрузится заново
+if page != "История":
+    st.session_state.pop("history_items", None)
 
 
 
@@ -381,58 +368,60 @@ if page == "Поиск":
     upload_method = st.radio("Выберите способ загрузки", ["Ввод вручную", "Загрузка файла", "Ссылка на сайт"])
 
     text = ""
+    file = None
+    url = ""
 
     if upload_method == "Ввод вручную":
         text = st.text_area("Введите текст")
 
     elif upload_method == "Загрузка файла":
+        # Файл уходит на сервер как есть, текст из него извлекается постранично в воркере
         file = st.file_uploader("Выберите PDF или Word файл", type=["pdf", "docx"])
-        if file:
-            if file.type == "application/pdf":
-                text = extract_text_from_pdf(file)
-            elif file.type in ["application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/msword"]:
-                text = extract_text_from_docx(file)
-            st.text_area("Извлечённый текст", text, height=300)
 
     elif upload_method == "Ссылка на сайт":
         url = st.text_input("Введите URL")
 
-        if "text_from_url" not in st.session_state:
-            st.session_state["text_from_url"] = ""
-
-        if st.button("Загрузить со страницы"):
-            if url:
-                extracted = extract_text_from_url(url)
-                st.session_state["text_from_url"] = extracted
-
-        text = st.session_state["text_from_url"]
-        # всегда отображаем поле
-        text = st.text_area("Извлечённый текст", text, height=300)
-
     if st.button("Сохранить и построить граф"):
         graph_id = st.session_state.get("selected_graph")
         if graph_id is None:
             st.error("Выберите граф перед построением.")
             st.stop()
-        clean_text = text.strip()
-        if not clean_text:
-            st.error("Текст пустой. Введите или загрузите данные.")
-            st.stop()
         try:
             graph_id = int(graph_id)
         except ValueError:
             st.error("Некорректный ID графа.")
             st.stop()
-        r = requests.post(f"{API_URL}/process_text/", json={
-            "text": text,
-            "graph_id": graph_id
-        }, headers=auth_headers())
+
+        if upload_method == "Загрузка файла":
+            if file is None:
+                st.error("Выберите файл.")
+                st.stop()
+            r = requests.post(f"{API_URL}/process_document/", data={"graph_id": graph_id},
+                              files={"file": (file.name, file, file.type)}, headers=auth_headers())
+        elif upload_method == "Ссылка на сайт":
+            if not url.strip():
+                st.error("Введите URL.")
+                st.stop()
+            r = requests.post(f"{API_URL}/process_url/", json={
+                "url": url.strip(),
+                "graph_id": graph_id
+            }, headers=auth_headers())
+        else:
+            if not text.strip():
+                st.error("Текст пустой. Введите или загрузите данные.")
+                st.stop()
+            r = requests.post(f"{API_URL}/process_text/", json={
+                "text": text,
+                "graph_id": graph_id
+            }, headers=auth_headers())
 
         if r.status_code == 200:
             task_id = r.json()["task_id"]
             st.success("Запрос отправлен. Подождите создание графа...")
             # Асинхронный запуск WebSocket
             asyncio.run(wait_for_graph_and_render(task_id, graph_id))
+        elif r.status_code in (400, 413):
+            st.error(r.json().get("detail", "Ошибка при отправке текста"))
         else:
             st.error("Ошибка при отправке текста")
 
@@ -471,20 +460,40 @@ if page == "Поиск":
 
 elif page == "История":
     st.subheader("📜 История запросов")
-    r = requests.get(f"{API_URL}/history/", headers=auth_headers())
-    if r.status_code == 200:
-        history = r.json()
-        if not history:
-            st.info("История запросов пуста.")
-        else:
-            for item in history:
-                dt = datetime.fromisoformat(item['created_at'])
-                formatted_date = dt.strftime("%d.%m.%Y %H:%M")
-                with st.expander(f"{formatted_date} — 📘 {item['graph_title']}"):
-                    st.markdown(f"**📝 Запрос:**\n\n{item['query']}")
-                    st.markdown(f"**🧠 Ответ:**\n\n{item['response']}")
-    else:
-        st.error("Ошибка загрузки истории.")
+    # История грузится страницами и хранится в сессии, чтобы перерисовка не запрашивала её заново
+    if "history_items" not in st.session_state or st.button("🔄 Обновить"):
+        st.session_state.history_items = []
+        st.session_state.history_cursor = None
+        st.session_state.history_loaded = False
+
+    def load_history_page():
+        params = {"limit": 50}
+        if st.session_state.history_cursor:
+            params["cursor"] = st.session_state.history_cursor
+        r = requests.get(f"{API_URL}/history/", params=params, headers=auth_headers())
+        if r.status_code != 200:
+            st.error("Ошибка загрузки истории.")
+            return
+        data = r.json()
+        st.session_state.history_items.extend(data["items"])
+        st.session_state.history_cursor = data["next_cursor"]
+        st.session_state.history_loaded = True
+
+    if not st.session_state.history_loaded:
+        load_history_page()
+
+    history = st.session_state.history_items
+    if st.session_state.history_loaded and not history:
+        st.info("История запросов пуста.")
+    for item in history:
+        dt = datetime.fromisoformat(item['created_at'])
+        formatted_date = dt.strftime("%d.%m.%Y %H:%M")
+        with st.expander(f"{formatted_date} — 📘 {item['graph_title']}"):
+            st.markdown(f"**📝 Запрос:**\n\n{item['query']}")
+            st.markdown(f"**🧠 Ответ:**\n\n{item['response']}")
+    if st.session_state.history_cursor and st.button("Показать ещё"):
+        load_history_page()
+        st.rerun()
 
 elif page == "Управление пользователями" and st.session_state.get("is_admin"):
     st.subheader("👥 Управление пользователями")